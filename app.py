@@ -1,47 +1,102 @@
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Flask, request, jsonify, send_from_directory, Response, stream_with_context, g
+import json
 import threading
 import asyncio
 import os
+import time
+from concurrent.futures import TimeoutError as FutureTimeout
 
 # Existing import
 import books_scraper_full as scraper
 
 # --- NEW imports for Name Extraction ---
-import stanza
-import spacy
-from langdetect import detect
-from collections import Counter
+from ner import NEREngine, NERProcessPool
 
 # --- NEW imports for Summarization ---
-from transformers import pipeline, AutoTokenizer, AutoModelForSeq2SeqLM
+from summarization import create_summarizer, summarize_long, iter_summarize_long
+from summary_server import SummaryServer
+from summary_cache import SummaryCache
 
 # --- NEW imports for Book Recommender ---
-import pandas as pd
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
+import recommender
+import embeddings
+from catalog import Catalog
+
+# --- Execution layer for the NLP routes (see execution.py / serve.py) ---
+from execution import ExecutionLayer, Rejected, DeadlineExceeded
+
+# --- Profiling (stage timers, stack sampler) ---
+import profiling
+from profiling import profiler
 
 # ---------------------------
 # Flask app
 # ---------------------------
 app = Flask(__name__, static_folder='.', static_url_path='')
 
+# model work of the NLP routes runs in worker processes (forked after the
+# models below are loaded) with per-endpoint limits, queues and deadlines
+execution = ExecutionLayer()
+
+@app.errorhandler(Rejected)
+def rejected(e):
+    headers = {"Retry-After": str(e.retry_after)} if e.retry_after else {}
+    return jsonify({"error": str(e)}), e.status, headers
+
+# every request is timed; a PROFILE_SAMPLE_RATE fraction also records its stages
+@app.before_request
+def start_profile():
+    g.profile = profiler.begin(request.endpoint or "unmatched")
+
+@app.teardown_request
+def finish_profile(exc):
+    handle = g.pop("profile", None)
+    if handle is not None:
+        profiler.end(handle)
+
+def request_timeout():
+    # clients may ask for a shorter deadline than the endpoint's own
+    ms = request.headers.get("X-Deadline-Ms", "")
+    return float(ms) / 1000.0 if ms.isdigit() else None
+
 # ---------------------------
 # Load NER Models
 # ---------------------------
-print("Loading Persian model (Stanza)...")
-fa_nlp = stanza.Pipeline('fa')
+# entity-only pipelines; concurrent requests are micro-batched here, in the
+# server process, and each batch runs in an inference process (execution.py)
+def ner_batch(texts, lang):
+    # runs in an inference process, which inherited ner_engine
+    return ner_engine.mentions(texts, lang)
 
-print("Loading English model (spaCy)...")
-en_nlp = spacy.load("en_core_web_sm")
+ner_engine = NEREngine(runner=lambda texts, lang: execution.run_batch("extract-names", ner_batch, texts, lang),
+                       concurrency=execution.processes)
+profiling.instrument_stanza(ner_engine.fa_nlp)   # per-processor stage timers
+# optional worker processes for /extract-names/batch (each loads its own models)
+NER_PROCESSES = int(os.environ.get("NER_PROCESSES", 0))
+ner_pool = NERProcessPool(NER_PROCESSES) if NER_PROCESSES > 0 else None
+MAX_BATCH_TEXTS = 256
 
 # ---------------------------
 # Load Summarization Model
 # ---------------------------
-print("Loading English summarization model...")
 SUMMARIZER_MODEL = "facebook/bart-large-cnn"
-tokenizer = AutoTokenizer.from_pretrained(SUMMARIZER_MODEL)
-model = AutoModelForSeq2SeqLM.from_pretrained(SUMMARIZER_MODEL)
-summarizer = pipeline("summarization", model=model, tokenizer=tokenizer, device=-1)
+# torch | torch-int8 | onnx | onnx-int8 (see summarization.py)
+SUMMARIZER_BACKEND = os.environ.get("SUMMARIZER_BACKEND", "torch")
+SUMMARIZER_THREADS = int(os.environ.get("SUMMARIZER_THREADS", 0)) or None
+print(f"Loading English summarization model ({SUMMARIZER_BACKEND} backend)...")
+summarizer = create_summarizer(SUMMARIZER_MODEL, device=-1, backend=SUMMARIZER_BACKEND, threads=SUMMARIZER_THREADS)
+tokenizer = summarizer.tokenizer
+profiling.instrument_pipeline(summarizer)        # tokenize / generate / decode stage timers
+# concurrent /summarize requests are queued and run as padded micro-batches in
+# the inference processes; summaries (including per-chunk ones) are cached on
+# disk and shared with review.py
+def summarize_batch(items):
+    # runs in an inference process, which inherited summary_server
+    return summary_server.run_batch(items)
+
+summary_server = SummaryServer(summarizer, cache=SummaryCache(),
+                               runner=lambda items: execution.run_batch("summarize", summarize_batch, items),
+                               concurrency=execution.processes)
 
 # ---------------------------
 # Load Books Dataset for Recommender
@@ -49,58 +104,41 @@ summarizer = pipeline("summarization", model=model, tokenizer=tokenizer, device=
 BOOKS_CSV_PATH = "Books.csv"  # حتما مسیر درست بدهید
 
 try:
-    books_df = pd.read_csv(BOOKS_CSV_PATH, on_bad_lines="skip", encoding="latin-1", low_memory=False, dtype=str)
-    books_df = books_df[["Book-Title", "Book-Author", "Publisher"]].dropna()
-    books_df["description"] = (
-        books_df["Book-Title"].astype(str) + " " +
-        books_df["Book-Author"].astype(str) + " " +
-        books_df["Publisher"].astype(str)
-    )
-
-    tfidf = TfidfVectorizer(stop_words="english")
-    tfidf_matrix = tfidf.fit_transform(books_df["description"])
-    print("Book recommender TF-IDF model loaded. Matrix shape:", tfidf_matrix.shape)
+    # compact catalog: no DataFrame / description column kept after vectorizing
+    books_catalog = Catalog.from_csv(BOOKS_CSV_PATH)
+    book_index = recommender.BookIndex(books_catalog)
+    print("Book recommender TF-IDF model loaded. Matrix shape:", book_index.shape)
 except Exception as e:
     print("Error loading book recommender:", e)
-    books_df = None
-    tfidf_matrix = None
+    book_index = None
 
-# ---------------------------
-# Persian Name Extractor
-# ---------------------------
-def extract_persian_names(text):
-    doc = fa_nlp(text)
-    names = set()
-    for ent in doc.ents:
-        if ent.type == 'pers':
-            name = ent.text.split()[0]
-            names.add(name)
-    return list(names)
+# Optional dense-embedding mode (build it first: python embeddings.py build)
+dense_index = None
+if book_index is not None and (embeddings.INDEX_DIR / "meta.json").exists():
+    try:
+        dense_index = embeddings.DenseIndex(embeddings.INDEX_DIR)
+        if dense_index.count != len(books_catalog):
+            print("Dense index is out of date with Books.csv, rebuild it. Dense mode disabled.")
+            dense_index = None
+        else:
+            book_index.listeners.append(dense_index.add_rows)
+            print("Dense recommender loaded:", dense_index.meta)
+    except Exception as e:
+        print("Error loading dense recommender:", e)
+        dense_index = None
 
-# ---------------------------
-# English Name Extractor
-# ---------------------------
-def extract_english_names(text):
-    doc = en_nlp(text)
-    persons = [ent.text.strip() for ent in doc.ents if ent.label_ == "PERSON"]
-    counted = Counter(persons)
-    return [name for name, _ in counted.most_common()]
+if book_index is not None:
+    book_index.load_scraped()
 
 # ---------------------------
 # Language Detection Router
 # ---------------------------
 def extract_names_general(text):
-    try:
-        lang = detect(text)
-    except:
-        lang = "unknown"
-
-    if lang == "fa":
-        return extract_persian_names(text)
-    elif lang == "en":
-        return extract_english_names(text)
-    else:
-        return []
+    # script-based routing (langroute.py); mixed texts go to both models in parallel
+    return ner_engine.extract(text)
+
+def extract_names_many(texts):
+    return ner_engine.extract_many(texts)
 
 # ---------------------------
 # API: Extract Names
@@ -111,12 +149,42 @@ def extract_names_api():
     text = data.get("text", "").strip()
     if not text:
         return jsonify({"error": "text is required"}), 400
-    names = extract_names_general(text)
+    names = execution.run("extract-names", extract_names_general, text, timeout=request_timeout())
     return jsonify({"names": names})
 
+@app.route('/extract-names/batch', methods=['POST'])
+def extract_names_batch_api():
+    data = request.get_json() or {}
+    texts = data.get("texts")
+    if not isinstance(texts, list) or not texts:
+        return jsonify({"error": "texts (a non-empty list) is required"}), 400
+    if len(texts) > MAX_BATCH_TEXTS:
+        return jsonify({"error": f"at most {MAX_BATCH_TEXTS} texts per request"}), 400
+    texts = [str(t).strip() for t in texts]
+    if ner_pool is not None and len(texts) > 1:
+        # already out of process (spawned NER workers): only admission control
+        # here, the pool's futures get what is left of the deadline
+        budget = execution.budget("extract-names", request_timeout())
+        deadline = time.monotonic() + budget
+
+        def extract_pooled():
+            try:
+                return ner_pool.extract_many(texts, timeout=max(0.0, deadline - time.monotonic()))
+            except FutureTimeout:
+                raise DeadlineExceeded(f"extract-names: no result within {budget:.1f}s")
+
+        names = execution.run("extract-names", extract_pooled, timeout=budget, where="inline")
+    else:
+        names = execution.run("extract-names", extract_names_many, texts, timeout=request_timeout())
+    return jsonify({"results": [{"names": n} for n in names]})
+
 # ---------------------------
 # API: Summarize Text
 # ---------------------------
+def summarize_text(text):
+    # long texts are chunked by tokens and reduced hierarchically instead of truncated
+    return summarize_long(text, summary_server, tokenizer, max_length=130, min_length=30, do_sample=False)
+
 @app.route('/summarize', methods=['POST'])
 def summarize_api():
     data = request.get_json() or {}
@@ -124,16 +192,48 @@ def summarize_api():
     if not text:
         return jsonify({"error": "text is required"}), 400
 
-    out = summarizer(text, max_length=130, min_length=30, do_sample=False)
-    summary = out[0]['summary_text'].strip()
+    summary = execution.run("summarize", summarize_text, text, timeout=request_timeout())
     return jsonify({"summary": summary})
 
+# ---------------------------
+# API: Summarize Text (streaming, server-sent events)
+# ---------------------------
+def summarize_events(text):
+    # runs in a stream process: long texts first emit one "chunk" event per
+    # finished chunk summary, then the final summary arrives as "token" events
+    yield from iter_summarize_long(text, summary_server, tokenizer, stream_final=True,
+                                   max_length=130, min_length=30, do_sample=False)
+
+@app.route('/summarize/stream', methods=['POST'])
+def summarize_stream_api():
+    data = request.get_json() or {}
+    text = data.get("text", "").strip()
+    if not text:
+        return jsonify({"error": "text is required"}), 400
+
+    # generated in a stream process (execution.py); this thread only relays the events
+    stream = execution.stream("summarize-stream", summarize_events, text, timeout=request_timeout())
+
+    def events():
+        try:
+            for event in stream:
+                yield f"event: {event['event']}\ndata: {json.dumps(event, ensure_ascii=False)}\n\n"
+        except Exception as e:
+            yield f"event: error\ndata: {json.dumps({'error': str(e)})}\n\n"
+        finally:
+            stream.close()
+
+    response = Response(stream_with_context(events()), mimetype="text/event-stream",
+                        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+    response.call_on_close(stream.close)   # also when the body was never iterated
+    return response
+
 # ---------------------------
 # API: Book Recommender
 # ---------------------------
 @app.route("/recommend", methods=["POST"])
 def recommend_books_api():
-    if books_df is None or tfidf_matrix is None:
+    if book_index is None:
         return jsonify({"error": "Book recommender not available"}), 500
 
     data = request.get_json() or {}
@@ -141,21 +241,60 @@ def recommend_books_api():
     if not keywords:
         return jsonify({"error": "keywords are required"}), 400
 
-    user_vec = tfidf.transform([keywords])
-    similarities = cosine_similarity(user_vec, tfidf_matrix).flatten()
-    top_indices = similarities.argsort()[-3:][::-1]
+    # books another worker scraped since the last request (one stat when there are none)
+    book_index.load_scraped()
+    mode = data.get("mode", "tfidf")
+    if mode == "tfidf":
+        results = execution.run("recommend", book_index.recommend, keywords, top_n=3, timeout=request_timeout())
+    elif mode == "dense":
+        if dense_index is None:
+            return jsonify({"error": "Dense recommender not available"}), 400
+        results = execution.run("recommend", dense_index.recommend, keywords, book_index.row, top_n=3,
+                                timeout=request_timeout())
+    else:
+        return jsonify({"error": "mode must be 'tfidf' or 'dense'"}), 400
+    return jsonify({"recommendations": results})
+
+# ---------------------------
+# Debug: profiling
+# ---------------------------
+PROFILE_TOKEN = os.environ.get("PROFILE_TOKEN")
 
-    results = []
-    for idx in top_indices:
-        book = books_df.iloc[idx]
-        results.append({
-            "title": book["Book-Title"],
-            "author": book["Book-Author"],
-            "publisher": book["Publisher"],
-            "score": float(similarities[idx])
-        })
+@app.route('/debug/profile', methods=['GET', 'POST'])
+def debug_profile():
+    # off unless PROFILE_TOKEN is set: behind a reverse proxy every request
+    # comes from 127.0.0.1, so the client address proves nothing
+    if not PROFILE_TOKEN:
+        return jsonify({"error": "profiling endpoint disabled (set PROFILE_TOKEN)"}), 404
+    if request.headers.get("X-Profile-Token") != PROFILE_TOKEN:
+        return jsonify({"error": "forbidden"}), 403
 
-    return jsonify({"recommendations": results})
+    top = request.args.get("top", "20")
+    if not top.isdigit():
+        return jsonify({"error": "top must be a non-negative integer"}), 400
+
+    if request.method == 'POST':
+        data = request.get_json(silent=True) or {}
+        if not isinstance(data, dict):
+            return jsonify({"error": "body must be a JSON object"}), 400
+        if "sample_rate" in data:
+            rate = data["sample_rate"]
+            if isinstance(rate, bool) or not isinstance(rate, (int, float)):
+                return jsonify({"error": "sample_rate must be a number between 0 and 1"}), 400
+            profiler.sample_rate = min(1.0, max(0.0, float(rate)))
+        if data.get("stacks") is True:
+            profiler.sampler.start()
+        elif data.get("stacks") is False:
+            profiler.sampler.stop()
+        if data.get("reset"):
+            profiler.reset()
+
+    if request.args.get("format") == "folded":
+        # flamegraph.pl / speedscope input
+        return Response(profiler.sampler.folded() + "\n", mimetype="text/plain")
+    snapshot = profiler.snapshot(top=int(top))
+    snapshot["execution"] = execution.stats()
+    return jsonify(snapshot)
 
 # ---------------------------
 # Existing Routes
@@ -166,7 +305,7 @@ def index():
 
 @app.route('/publishers')
 def get_publishers():
-    pub_list = list(scraper.SCRAPERS_MAP.keys())
+    pub_list = scraper.publisher_names()   # publishers.json, re-read when it changes
     return jsonify({"publishers": pub_list})
 
 @app.route('/subscribe', methods=['POST'])
@@ -182,7 +321,10 @@ def subscribe():
     def worker(e, pubs):
         try:
             print(f"[Worker] Starting scraping for {e} -> {pubs}")
-            asyncio.run(scraper.run_for(pubs, e))
+            books = asyncio.run(scraper.run_for(pubs, e))
+            if book_index is not None and books:
+                # make fresh releases searchable right away (no TF-IDF refit)
+                book_index.add_books(books)
             print("[Worker] Worker finished")
         except Exception as exc:
             print("[Worker] exception:", exc)
@@ -192,6 +334,10 @@ def subscribe():
     return jsonify({"message": "Subscription accepted. Scraping started."}), 200
 
 # ---------------------------
+# Development server. No reloader: it would start a second process and load
+# every model twice. For production use serve.py (multi-process, preloaded).
 if __name__ == "__main__":
     port = int(os.environ.get("PORT", 5000))
-    app.run(host='0.0.0.0', port=port, debug=True)
+    execution.start()   # fork the inference processes before the server starts its threads
+    app.run(host='0.0.0.0', port=port, debug=os.environ.get("FLASK_DEBUG") == "1",
+            use_reloader=False, threaded=True)
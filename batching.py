@@ -0,0 +1,171 @@
+# batching.py
+# Generic dynamic micro-batcher.
+#
+# Callers on many threads submit single items; one worker thread collects them
+# into batches (up to max_batch_size items, waiting at most max_wait_ms after the
+# first one arrives) and runs them through a batch function in one call.
+# Items are only batched together when they share the same `key`
+# (e.g. identical generation parameters). Sampled requests (profiling.py) get
+# their queue wait and the stages of the batch they ran in. A batch function
+# that returns the wrong number of results fails every item of the batch.
+
+import os
+import threading
+import time
+import weakref
+from collections import deque
+from concurrent.futures import Future
+
+import profiling
+
+IDLE_EXIT_S = 30.0   # the worker thread exits after this long without work (restarted on submit)
+
+# a forked worker process (gunicorn, process pools) inherits every batcher but
+# not its worker thread, so each starts over in the child; one fork hook for all
+# of them, and the set does not keep dead batchers alive
+_batchers = weakref.WeakSet()
+
+
+def _reset_after_fork():
+    for batcher in list(_batchers):
+        batcher._reset()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+class MicroBatcher:
+    def __init__(self, process_batch, max_batch_size=8, max_wait_ms=10, name="batcher", concurrency=1):
+        """
+        process_batch: fn(list of items) -> list of results (same length and order).
+        concurrency: batches run at once (worker threads), e.g. one per
+        inference process when process_batch hands the batch to a process pool.
+        """
+        self.process_batch = process_batch
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+        self.name = name
+        self.concurrency = max(1, int(concurrency))
+        self.batches = 0
+        self.items = 0
+        self._reset()
+        _batchers.add(self)
+
+    def _reset(self):
+        self._cond = threading.Condition()
+        self._pending = deque()
+        self._workers = set()
+        self._idle = 0
+
+    def _ensure_worker(self):
+        # lock is held by the caller; start another worker while none is free to take the item
+        if self._idle:
+            return
+        self._workers = {w for w in self._workers if w.is_alive()}
+        if len(self._workers) < self.concurrency:
+            worker = threading.Thread(target=self._run, name=self.name, daemon=True)
+            self._workers.add(worker)
+            worker.start()
+
+    def submit(self, item, key=None):
+        fut = Future()
+        with self._cond:
+            self._ensure_worker()
+            # the caller's request profile, if sampled, and the enqueue time
+            self._pending.append((key, item, fut, profiling.current(), time.perf_counter()))
+            self._cond.notify()
+        return fut
+
+    def submit_many(self, items, key=None):
+        """
+        Queue several items at once; returns their futures. They are enqueued
+        under one lock, so the worker sees all of them together even with
+        max_wait_ms=0 (e.g. every chunk of a text, see summarization.py).
+        """
+        prof, now = profiling.current(), time.perf_counter()
+        futs = [Future() for _ in items]
+        with self._cond:
+            self._ensure_worker()
+            for item, fut in zip(items, futs):
+                self._pending.append((key, item, fut, prof, now))
+            self._cond.notify()
+        return futs
+
+    def __call__(self, item, key=None, timeout=None):
+        return self.submit(item, key).result(timeout)
+
+    @property
+    def queue_depth(self):
+        return len(self._pending)
+
+    @property
+    def mean_batch_size(self):
+        return self.items / self.batches if self.batches else 0.0
+
+    def _take_batch(self):
+        # lock is held by the caller; None once the worker has been idle for IDLE_EXIT_S
+        idle_until = time.monotonic() + IDLE_EXIT_S
+        self._idle += 1
+        try:
+            while not self._pending:
+                remaining = idle_until - time.monotonic()
+                if remaining <= 0:
+                    return None
+                self._cond.wait(remaining)
+        finally:
+            self._idle -= 1
+        key = self._pending[0][0]
+        deadline = time.monotonic() + self.max_wait
+        while True:
+            same = sum(1 for entry in self._pending if entry[0] == key)
+            remaining = deadline - time.monotonic()
+            if same >= self.max_batch_size or remaining <= 0:
+                break
+            self._cond.wait(remaining)
+
+        batch, rest = [], deque()
+        for entry in self._pending:
+            if entry[0] == key and len(batch) < self.max_batch_size:
+                batch.append(entry)
+            else:
+                rest.append(entry)
+        self._pending = rest
+        return batch
+
+    def _run(self):
+        while True:
+            with self._cond:
+                batch = self._take_batch()
+                if batch is None:
+                    # let an unused batcher be garbage collected; submit() starts a new worker
+                    self._workers.discard(threading.current_thread())
+                    return
+            # drop requests whose callers already gave up
+            batch = [e for e in batch if e[2].set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            started = time.perf_counter()
+            profiles = [(prof, queued) for _, _, _, prof, queued in batch if prof is not None]
+            batch_prof = profiling.RequestProfile() if profiles else None
+            try:
+                with profiling.collect(batch_prof):
+                    results = list(self.process_batch([item for _, item, _, _, _ in batch]))
+                error = None
+                if len(results) != len(batch):
+                    error = RuntimeError(f"{self.name}: batch function returned {len(results)} results "
+                                         f"for {len(batch)} items")
+            except Exception as e:
+                error = e
+            # before resolving the futures, so the stages land in the requests' profiles
+            for prof, queued in profiles:
+                prof.stages.append((f"{self.name}.queue", started - queued))
+                prof.stages.extend(batch_prof.stages)
+            if error is not None:
+                for _, _, fut, _, _ in batch:
+                    fut.set_exception(error)
+            else:
+                for (_, _, fut, _, _), res in zip(batch, results):
+                    fut.set_result(res)
+            with self._cond:
+                self.batches += 1
+                self.items += len(batch)
@@ -0,0 +1,263 @@
+"""
+book_characters.py
+Whole-book character extraction (English / Persian, txt or EPUB).
+
+The book is streamed paragraph by paragraph (only one batch of paragraphs is
+in memory at a time), each batch is run through the NER engine from ner.py,
+and person mentions are merged into one character index ranked by number of
+mentions, with the character offset of each name's first appearance.
+Progress is checkpointed, so an interrupted run continues where it stopped.
+
+Usage:
+    python book_characters.py book.txt --out characters.json
+    python book_characters.py book.epub --out characters.json --top 50
+"""
+
+import argparse
+import json
+import os
+import posixpath
+import time
+import zipfile
+import xml.etree.ElementTree as ET
+from html.parser import HTMLParser
+from urllib.parse import unquote
+
+from langroute import split_by_language
+
+# --------- Configurable defaults ----------
+BATCH_PARAGRAPHS = 32        # paragraphs per NER batch
+CHECKPOINT_EVERY = 200       # paragraphs between checkpoints
+MAX_PARAGRAPH_CHARS = 5000   # longer "paragraphs" (no blank lines) are cut at line ends
+# ------------------------------------------
+
+
+# ---------------------------
+# Readers: yield (char_offset, paragraph)
+# ---------------------------
+def iter_txt_paragraphs(path):
+    # paragraphs keep their raw lines (indentation, line breaks), so that
+    # start + an offset inside the paragraph is the offset in the file
+    offset = 0
+    start = 0
+    lines = []
+    size = 0
+    with open(path, "r", encoding="utf-8", errors="replace", newline="") as f:
+        for line in f:
+            if line.strip():
+                if not lines:
+                    start = offset
+                lines.append(line)
+                size += len(line)
+            if lines and (not line.strip() or size >= MAX_PARAGRAPH_CHARS):
+                yield start, "".join(lines).rstrip()
+                lines, size = [], 0
+            offset += len(line)
+    if lines:
+        yield start, "".join(lines).rstrip()
+
+
+class _ParagraphParser(HTMLParser):
+    BLOCK_TAGS = {"p", "div", "h1", "h2", "h3", "h4", "h5", "h6", "li", "blockquote", "br", "section"}
+    SKIP_TAGS = {"script", "style", "head"}
+
+    def __init__(self):
+        super().__init__()
+        self.paragraphs = []
+        self._parts = []
+        self._skip = 0
+
+    def _flush(self):
+        text = " ".join("".join(self._parts).split())
+        if text:
+            self.paragraphs.append(text)
+        self._parts = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self.SKIP_TAGS:
+            self._skip += 1
+        elif tag in self.BLOCK_TAGS:
+            self._flush()
+
+    def handle_endtag(self, tag):
+        if tag in self.SKIP_TAGS:
+            self._skip = max(0, self._skip - 1)
+        elif tag in self.BLOCK_TAGS:
+            self._flush()
+
+    def handle_data(self, data):
+        if not self._skip:
+            self._parts.append(data)
+
+    def close(self):
+        super().close()
+        self._flush()
+
+
+def iter_epub_paragraphs(path):
+    """Paragraphs of the EPUB's spine documents in reading order (one document in memory at a time)."""
+    container_ns = "{urn:oasis:names:tc:opendocument:xmlns:container}"
+    opf_ns = "{http://www.idpf.org/2007/opf}"
+    offset = 0
+    with zipfile.ZipFile(path) as z:
+        container = ET.fromstring(z.read("META-INF/container.xml"))
+        opf_path = container.find(f".//{container_ns}rootfile").get("full-path")
+        opf = ET.fromstring(z.read(opf_path))
+        base = posixpath.dirname(opf_path)
+        manifest = {item.get("id"): item.get("href") for item in opf.iter(f"{opf_ns}item")}
+        for itemref in opf.iter(f"{opf_ns}itemref"):
+            href = manifest.get(itemref.get("idref"))
+            if not href:
+                continue
+            name = posixpath.normpath(posixpath.join(base, unquote(href)))
+            try:
+                html = z.read(name).decode("utf-8", errors="replace")
+            except KeyError:
+                continue
+            parser = _ParagraphParser()
+            parser.feed(html)
+            parser.close()
+            for paragraph in parser.paragraphs:
+                yield offset, paragraph
+                offset += len(paragraph) + 2   # as if paragraphs were joined by a blank line
+
+
+def iter_paragraphs(path):
+    if path.lower().endswith(".epub"):
+        return iter_epub_paragraphs(path)
+    return iter_txt_paragraphs(path)
+
+
+# ---------------------------
+# Character index
+# ---------------------------
+class CharacterIndex:
+    def __init__(self, characters=None):
+        # name -> {"count": int, "first_offset": int, "lang": str}
+        self.characters = characters or {}
+
+    def add(self, name, offset, lang):
+        entry = self.characters.get(name)
+        if entry is None:
+            self.characters[name] = {"count": 1, "first_offset": offset, "lang": lang}
+        else:
+            entry["count"] += 1
+            entry["first_offset"] = min(entry["first_offset"], offset)
+
+    def ranked(self):
+        items = sorted(self.characters.items(), key=lambda kv: (-kv[1]["count"], kv[1]["first_offset"]))
+        return [dict(name=name, **entry) for name, entry in items]
+
+
+# ---------------------------
+# Checkpoints
+# ---------------------------
+def _source_id(path):
+    st = os.stat(path)
+    return {"path": os.path.abspath(path), "size": st.st_size, "mtime": int(st.st_mtime)}
+
+
+def load_checkpoint(checkpoint_path, source_path):
+    if not os.path.exists(checkpoint_path):
+        return None
+    try:
+        with open(checkpoint_path, encoding="utf-8") as f:
+            state = json.load(f)
+    except ValueError:
+        return None
+    if state.get("source") != _source_id(source_path):
+        print("Checkpoint belongs to a different (or changed) file, starting over.")
+        return None
+    return state
+
+
+def save_checkpoint(checkpoint_path, source_path, next_paragraph, index):
+    tmp = checkpoint_path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump({
+            "source": _source_id(source_path),
+            "next_paragraph": next_paragraph,
+            "characters": index.characters,
+        }, f, ensure_ascii=False)
+    os.replace(tmp, checkpoint_path)   # atomic: a crash never leaves a half-written checkpoint
+
+
+# ---------------------------
+# Extraction
+# ---------------------------
+def _process_batch(engine, batch, index):
+    by_lang = {}
+    for offset, text in batch:
+        # mixed-language paragraphs are split into per-language segments
+        for lang, start, segment in split_by_language(text):
+            by_lang.setdefault(lang, []).append((offset + start, segment))
+    for lang, items in by_lang.items():
+        if lang not in ("fa", "en"):
+            continue
+        mentions = engine.mentions([text for _, text in items], lang)
+        for (offset, _), found in zip(items, mentions):
+            for name, start in found:
+                index.add(name, offset + start, lang)
+
+
+def extract_book_characters(path, engine, checkpoint_path=None, batch_size=BATCH_PARAGRAPHS,
+                            checkpoint_every=CHECKPOINT_EVERY):
+    checkpoint_path = checkpoint_path or path + ".characters.checkpoint.json"
+    state = load_checkpoint(checkpoint_path, path)
+    index = CharacterIndex(state["characters"] if state else None)
+    start_at = state["next_paragraph"] if state else 0
+    if start_at:
+        print(f"Resuming from paragraph {start_at} ({len(index.characters)} characters so far)")
+
+    t0 = time.perf_counter()
+    batch = []
+    done = start_at
+    last_checkpoint = start_at
+    for i, (offset, text) in enumerate(iter_paragraphs(path)):
+        if i < start_at:
+            continue
+        batch.append((offset, text))
+        if len(batch) >= batch_size:
+            _process_batch(engine, batch, index)
+            done = i + 1
+            batch = []
+            if done - last_checkpoint >= checkpoint_every:
+                save_checkpoint(checkpoint_path, path, done, index)
+                last_checkpoint = done
+                rate = (done - start_at) / (time.perf_counter() - t0)
+                print(f"  {done} paragraphs, {len(index.characters)} characters ({rate:.1f} paragraphs/s)")
+    if batch:
+        _process_batch(engine, batch, index)
+        done += len(batch)
+    save_checkpoint(checkpoint_path, path, done, index)
+    return index
+
+
+def main():
+    from ner import NEREngine
+
+    parser = argparse.ArgumentParser(description="Extract a ranked character index from a whole book (txt / EPUB).")
+    parser.add_argument("book", help="Path to a .txt (UTF-8) or .epub file.")
+    parser.add_argument("--out", "-o", help="Write the character index to this JSON file.")
+    parser.add_argument("--checkpoint", help="Checkpoint file (default: <book>.characters.checkpoint.json).")
+    parser.add_argument("--batch-size", type=int, default=BATCH_PARAGRAPHS)
+    parser.add_argument("--checkpoint-every", type=int, default=CHECKPOINT_EVERY)
+    parser.add_argument("--top", type=int, default=30, help="Number of characters to print.")
+    args = parser.parse_args()
+
+    engine = NEREngine()
+    index = extract_book_characters(args.book, engine, args.checkpoint, args.batch_size, args.checkpoint_every)
+    ranked = index.ranked()
+
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(ranked, f, ensure_ascii=False, indent=2)
+        print(f"Saved {len(ranked)} characters to {args.out}")
+
+    print("\n" + "=" * 40 + "\nCHARACTERS (by mentions):\n" + "=" * 40)
+    for c in ranked[:args.top]:
+        print(f"{c['count']:>6}  {c['name']}  (first at char {c['first_offset']})")
+
+
+if __name__ == "__main__":
+    main()
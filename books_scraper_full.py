@@ -4,12 +4,23 @@
 #   playwright install
 #
 # This file exports an async runner `run_for(publishers, receiver_email, per_publisher=3)`
-# that collects books from the requested publishers, downloads images, saves JSON and sends an email.
+# that collects books from the requested publishers, downloads images, saves JSON, sends an email
+# and returns the collected books.
 # It can also be run standalone (will scrape all configured publishers and send to the configured RECEIVER_EMAIL).
+#
+# Publishers (URL, selectors, waits) are defined in publishers.json and scraped by one
+# generic engine. The file is re-read whenever it changes, so a selector fix takes effect
+# on the next subscription without restarting the app.
+# Each publisher's page-load timeout adapts to its recent latencies, and a publisher that
+# keeps failing is skipped for a cool-down period, its last good result served instead
+# (publisher_health.py).
 
 import asyncio
 import json
+import os
 import re
+import threading
+import time
 from pathlib import Path
 from urllib.parse import urljoin
 import mimetypes
@@ -18,7 +29,9 @@ from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 from email.mime.image import MIMEImage
 
-from playwright.async_api import async_playwright, TimeoutError as PWTimeout
+from playwright.async_api import async_playwright, Error as PWError, TimeoutError as PWTimeout
+
+from publisher_health import health
 # ======================
 # Email Settings (replace with real values or override at runtime and you need your app password frm google)
 # ======================
@@ -33,14 +46,10 @@ IMAGE_DIR = Path("book_images")
 IMAGE_DIR.mkdir(exist_ok=True)
 
 # ======================
-# Site URLs
+# Publisher definitions
 # ======================
-BAAZH_URL = "https://baazhbook.com/"
-PORTEGHAAL_URL = "https://porteghaal.com/"
-TANDIS_URL = "https://tandispub.com/"
-TOR_URL = "https://torpublishinggroup.com/"
-DAW_URL = "https://astrapublishinghouse.com/"
-FANTASYLIT_URL = "https://fantasyliterature.com/"
+PUBLISHERS_PATH = Path(os.environ.get("PUBLISHERS_PATH", "publishers.json"))
+DEFAULT_TIMEOUT_MS = 90000
 
 # ======================
 # Utilities
@@ -130,252 +139,211 @@ def unique_path(path: Path) -> Path:
         i += 1
 
 # ======================
-# Scrapers
+# Publisher definitions (hot reloaded)
 # ======================
-
-async def scrape_baazh(context):
-    books = []
-    page = await context.new_page()
+# publishers.json: {"<name>": {
+#     "url": ..., "container": <selector of one book>,
+#     "fields": {"<field>": <field spec>, ...},     # "title" is required
+#     "constants": {"<field>": value, ...},         # e.g. {"price": "N/A"}
+#     "tag": <log prefix>, "timeout_ms": <navigation timeout>,
+#     "wait_for": {"selector", "timeout_ms", "required"},  # wait after loading
+#     "scrolls": <n>, "scroll_pause_s": <s>}}        # for lazily loaded lists
+# field spec: "selector" (none = the container itself), then one of
+#   "attr": <attribute>   (default: the element's text)
+#   "image_attrs": [...]  image URL from these attributes, "pick": "best" (largest srcset, default) or "first"
+# and optionally "default", "join_url" (resolve against url), "regex" + "group",
+# "collapse_ws", "fallback": <field spec tried when the value is empty>.
+# A string is shorthand for {"selector": <string>}.
+
+_publishers = {}
+_publishers_stamp = None
+_publishers_lock = threading.Lock()
+
+
+def _field_spec(spec):
+    return {"selector": spec} if isinstance(spec, str) else spec
+
+
+def _check_type(where, value, types, what):
+    if isinstance(value, bool) or not isinstance(value, types):
+        raise ValueError(f"{where} must be {what}")
+
+
+def _validate_field(where, fspec):
+    if isinstance(fspec, str):
+        return
+    _check_type(where, fspec, dict, "a selector string or an object")
+    for key in ("selector", "attr", "regex", "pick"):
+        if fspec.get(key) is not None:
+            _check_type(f"{where}.{key}", fspec[key], str, "a string")
+    if "image_attrs" in fspec:
+        attrs = fspec["image_attrs"]
+        if not isinstance(attrs, list) or not attrs or not all(isinstance(a, str) for a in attrs):
+            raise ValueError(f"{where}.image_attrs must be a non-empty list of strings")
+    if "group" in fspec:
+        _check_type(f"{where}.group", fspec["group"], int, "an integer")
+    if fspec.get("regex"):
+        re.compile(fspec["regex"])   # re.error is a ValueError
+    if fspec.get("pick", "best") not in ("best", "first"):
+        raise ValueError(f"{where}: pick must be 'best' or 'first'")
+    if fspec.get("fallback") is not None:
+        _validate_field(f"{where}.fallback", fspec["fallback"])
+
+
+def validate_publishers(config):
+    """Raise ValueError unless config is a well-formed publishers.json (types included)."""
+    if not isinstance(config, dict):
+        raise ValueError("top level must be an object of publisher name -> definition")
+    for name, spec in config.items():
+        _check_type(name, spec, dict, "an object")
+        for key in ("url", "container", "fields"):
+            if key not in spec:
+                raise ValueError(f"{name}: missing {key!r}")
+        for key in ("url", "container", "tag", "wait_until"):
+            if key in spec:
+                _check_type(f"{name}.{key}", spec[key], str, "a string")
+        for key in ("timeout_ms", "scroll_pause_s"):
+            if key in spec:
+                _check_type(f"{name}.{key}", spec[key], (int, float), "a number")
+        if "scrolls" in spec:
+            _check_type(f"{name}.scrolls", spec["scrolls"], int, "an integer")
+        if "constants" in spec:
+            _check_type(f"{name}.constants", spec["constants"], dict, "an object")
+        if "wait_for" in spec:
+            wait = spec["wait_for"]
+            _check_type(f"{name}.wait_for", wait, dict, "an object")
+            _check_type(f"{name}.wait_for.selector", wait.get("selector"), str, "a string")
+            if "timeout_ms" in wait:
+                _check_type(f"{name}.wait_for.timeout_ms", wait["timeout_ms"], (int, float), "a number")
+        _check_type(f"{name}.fields", spec["fields"], dict, "an object")
+        if "title" not in spec["fields"]:
+            raise ValueError(f"{name}: fields must include 'title'")
+        for field, fspec in spec["fields"].items():
+            _validate_field(f"{name}.{field}", fspec)
+
+
+def load_publishers(path=None):
+    """
+    Publisher definitions from publishers.json, re-read when the file changes
+    (mtime / size). A file that fails to parse or validate is reported and the
+    previous definitions stay in use.
+    """
+    global _publishers, _publishers_stamp
+    path = Path(path or PUBLISHERS_PATH)
     try:
-        await page.goto(BAAZH_URL, timeout=90000, wait_until="load")
-        containers = await page.query_selector_all("div.product-grid-item")
-        for el in containers:
-            title_el = await el.query_selector("h3.wd-entities-title a")
-            title = await title_el.inner_text() if title_el else "No Title"
-            link = await title_el.get_attribute("href") if title_el else "#"
-            link = urljoin(BAAZH_URL, link)
-            price_el = await el.query_selector("span.price")
-            price = await price_el.inner_text() if price_el else "No Price"
-            img_el = await el.query_selector("div.product-element-top img")
-            image = pick_best_image(BAAZH_URL, {
-                "src": await img_el.get_attribute("src") if img_el else "",
-                "data-src": await img_el.get_attribute("data-src") if img_el else "",
-                "srcset": await img_el.get_attribute("srcset") if img_el else "",
-                "data-srcset": await img_el.get_attribute("data-srcset") if img_el else ""
-            })
-            books.append({
-                "publisher": "Baazh Book",
-                "title": title.strip(),
-                "price": price.strip(),
-                "image": image,
-                "link": link,
-                "description": ""
-            })
-        print(f"[Baazh] Found {len(books)} items")
-    except PWTimeout:
-        print("Timeout while loading BaazhBook.")
-    finally:
-        await page.close()
-    return books
+        st = path.stat()
+    except OSError as e:
+        if not _publishers:
+            print(f"[Publishers] cannot read {path}: {e}")
+        return _publishers
+    stamp = (str(path), st.st_mtime_ns, st.st_size)
+    with _publishers_lock:
+        if stamp != _publishers_stamp:
+            _publishers_stamp = stamp   # a broken file is reported once, not on every call
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    config = json.load(f)
+                validate_publishers(config)
+            except Exception as e:   # OSError, ValueError and anything validation missed
+                print(f"[Publishers] {path} not loaded, keeping the previous definitions: {e}")
+            else:
+                _publishers = config
+                print(f"[Publishers] loaded {len(config)} publishers from {path}")
+        return _publishers
 
-async def scrape_porteghaal(context):
-    books = []
-    page = await context.new_page()
-    try:
-        await page.goto(PORTEGHAAL_URL, timeout=90000, wait_until="load")
-        containers = await page.query_selector_all("a.porteghal-slider-item")
-        for el in containers:
-            title_el = await el.query_selector("p.cart-title")
-            title = await title_el.inner_text() if title_el else "No Title"
-            link = await el.get_attribute("href") or "#"
-            link = urljoin(PORTEGHAAL_URL, link)
-            price_el = await el.query_selector("p.sale-price span.font-semibold")
-            price = await price_el.inner_text() if price_el else "No Price"
-            img_el = await el.query_selector("img.porteghal-card-pic")
-            image = pick_best_image(PORTEGHAAL_URL, {
-                "src": await img_el.get_attribute("src") if img_el else "",
-                "data-src": await img_el.get_attribute("data-src") if img_el else "",
-                "srcset": await img_el.get_attribute("srcset") if img_el else "",
-                "data-srcset": await img_el.get_attribute("data-srcset") if img_el else ""
-            })
-            books.append({
-                "publisher": "Porteghaal",
-                "title": title.strip(),
-                "price": price.strip(),
-                "image": image,
-                "link": link,
-                "description": ""
-            })
-        print(f"[Porteghaal] Found {len(books)} items")
-    except PWTimeout:
-        print("Timeout while loading Porteghaal.")
-    finally:
-        await page.close()
-    return books
 
-async def scrape_tandis(context):
-    books = []
-    page = await context.new_page()
-    try:
-        await page.goto(TANDIS_URL, timeout=90000, wait_until="load")
-        containers = await page.query_selector_all("div.sc-item-content")
-        for el in containers:
-            title_el = await el.query_selector("h3")
-            title = await title_el.inner_text() if title_el else "No Title"
-            link_node = await el.query_selector("a[href^='https://tandispub.com/book/']")
-            link = await link_node.get_attribute("href") if link_node else "#"
-            img_el = await el.query_selector("a.fimage img")
-            image = pick_best_image(TANDIS_URL, {
-                "src": await img_el.get_attribute("src") if img_el else "",
-                "data-src": await img_el.get_attribute("data-src") if img_el else "",
-                "srcset": await img_el.get_attribute("srcset") if img_el else "",
-                "data-srcset": await img_el.get_attribute("data-srcset") if img_el else ""
-            })
-            price_el = await el.query_selector("p.price")
-            price = await price_el.inner_text() if price_el else "No Price"
-            books.append({
-                "publisher": "Tandis Pub",
-                "title": title.strip(),
-                "price": price.strip(),
-                "image": image,
-                "link": link,
-                "description": ""
-            })
-        print(f"[Tandis] Found {len(books)} items")
-    except PWTimeout:
-        print("Timeout while loading Tandis.")
-    finally:
-        await page.close()
-    return books
+def publisher_names():
+    return list(load_publishers().keys())
 
-async def scrape_tor(context):
-    books = []
-    page = await context.new_page()
-    try:
-        await page.goto(TOR_URL, timeout=90000, wait_until="load")
-        containers = await page.query_selector_all("div.card-list-item")
-        for el in containers:
-            title_el = await el.query_selector("h3.card-post-title a")
-            title = await title_el.inner_text() if title_el else "No Title"
-            link = await title_el.get_attribute("href") if title_el else "#"
-            link = urljoin(TOR_URL, link)
-            img_el = await el.query_selector("img[ix-src], img[src]")
-            image = pick_best_image(TOR_URL, {
-                "src": await img_el.get_attribute("src") if img_el else "",
-                "ix-src": await img_el.get_attribute("ix-src") if img_el else ""
-            })
-            books.append({
-                "publisher": "Tor Books",
-                "title": title.strip(),
-                "price": "N/A",
-                "image": image,
-                "link": link,
-                "description": ""
-            })
-        print(f"[Tor] Found {len(books)} items")
-    except PWTimeout:
-        print("Timeout while loading Tor Books.")
-    finally:
-        await page.close()
-    return books
 
-async def scrape_daw(context):
-    books = []
-    page = await context.new_page()
-    try:
-        await page.goto(DAW_URL, timeout=90000, wait_until="load")
-        await page.wait_for_selector("div.portfolio-item-wrap", timeout=15000)
-        containers = await page.query_selector_all("div.portfolio-item-wrap")
-        for el in containers:
-            link = await el.get_attribute("data-permalink") or "#"
-            link = urljoin(DAW_URL, link)
-            title_el = await el.query_selector("h3")
-            title = await title_el.inner_text() if title_el else "No Title"
-            img_el = await el.query_selector("div.portfolio-image img")
-            image = pick_best_image(DAW_URL, {
-                "src": await img_el.get_attribute("src") if img_el else ""
-            })
-            author_el = await el.query_selector("span")
-            author = await author_el.inner_text() if author_el else ""
-            books.append({
-                "publisher": "DAW Books",
-                "title": title.strip(),
-                "author": author.strip(),
-                "price": "N/A",
-                "image": image,
-                "link": link,
-                "description": ""
-            })
-        print(f"[DAW] Found {len(books)} items")
-    except PWTimeout:
-        print("Timeout while loading DAW Books.")
-    finally:
-        await page.close()
-    return books
+# ======================
+# Generic scraper
+# ======================
+def pick_first_image(base_url: str, attrs: dict, order) -> str:
+    """First non-empty attribute in order (first URL of a srcset), not the largest."""
+    for key in order:
+        value = (attrs.get(key) or "").strip()
+        if value and key.endswith("srcset"):
+            value = value.split(",")[0].strip().split(" ")[0]
+        if value:
+            return urljoin(base_url, value)
+    return ""
 
-async def scrape_fantasylit(context):
+async def extract_field(el, spec, base_url):
+    spec = _field_spec(spec)
+    node = await el.query_selector(spec["selector"]) if spec.get("selector") else el
+    value = ""
+    if node is not None:
+        try:
+            if "image_attrs" in spec:
+                attrs = {a: (await node.get_attribute(a)) or "" for a in spec["image_attrs"]}
+                if spec.get("pick", "best") == "first":
+                    value = pick_first_image(base_url, attrs, spec["image_attrs"])
+                else:
+                    value = pick_best_image(base_url, attrs)
+            elif spec.get("attr"):
+                value = (await node.get_attribute(spec["attr"])) or ""
+            else:
+                value = (await node.inner_text()) or ""
+        except PWError:
+            value = ""
+    value = value.strip()
+    if value and spec.get("regex"):
+        m = re.search(spec["regex"], value)
+        value = m.group(spec.get("group", 1)).strip() if m else ""
+    if spec.get("collapse_ws"):
+        value = re.sub(r"\s+", " ", value)
+    if not value and spec.get("fallback"):
+        value = await extract_field(el, spec["fallback"], base_url)
+    if not value:
+        value = spec.get("default", "")
+    if value and spec.get("join_url"):
+        value = urljoin(base_url, value)
+    return value
+
+async def scrape_publisher(context, name, spec, timeout_ms=None, timings=None):
+    """
+    Scrape one publisher. timeout_ms (default: the definition's timeout_ms) is
+    the budget for loading the page, shared by the navigation and the
+    wait_for selector; the time that took is stored in timings["load_s"]
+    when a dict is passed. A timeout is logged and re-raised.
+    """
+    tag = spec.get("tag", name)
+    url = spec["url"]
+    budget_ms = timeout_ms or spec.get("timeout_ms", DEFAULT_TIMEOUT_MS)
+    loop = asyncio.get_running_loop()
+    started = loop.time()
     books = []
     page = await context.new_page()
     try:
-        print("[FantasyLit] Opening page...")
-        await page.goto(FANTASYLIT_URL, timeout=90000, wait_until="load")
-        try:
-            await page.wait_for_selector("article.post", timeout=30000)
-        except PWTimeout:
-            print("[FantasyLit] no article.post within 30s — continuing to try to find content")
-        for _ in range(3):
+        await page.goto(url, timeout=budget_ms, wait_until=spec.get("wait_until", "load"))
+        wait = spec.get("wait_for")
+        if wait:
+            remaining_ms = budget_ms - (loop.time() - started) * 1000.0
+            timeout = max(1000, min(wait.get("timeout_ms", 15000), remaining_ms))
+            try:
+                await page.wait_for_selector(wait["selector"], timeout=timeout)
+            except PWTimeout:
+                if wait.get("required", True):
+                    raise
+                print(f"[{tag}] no {wait['selector']} within {timeout / 1000:.0f}s — continuing to try to find content")
+        if timings is not None:
+            timings["load_s"] = loop.time() - started
+        for _ in range(spec.get("scrolls", 0)):
             await page.evaluate("window.scrollBy(0, window.innerHeight);")
-            await asyncio.sleep(1.0)
-        containers = await page.query_selector_all("article.post")
-        print(f"[FantasyLit] Found {len(containers)} article.post elements")
-        for idx, el in enumerate(containers, start=1):
-            link_el = await el.query_selector("h2.post-title a")
-            title = (await link_el.inner_text()) if link_el else "No Title"
-            title = title.strip()
-            link = (await link_el.get_attribute("href")) if link_el else "#"
-            if link:
-                link = urljoin(FANTASYLIT_URL, link)
-            img_el = await el.query_selector(".header a img, .header img")
-            img_src = ""
-            if img_el:
-                img_src = (await img_el.get_attribute("src")) or ""
-                if not img_src:
-                    img_src = (await img_el.get_attribute("data-src")) or ""
-                if not img_src:
-                    srcset = (await img_el.get_attribute("srcset")) or ""
-                    if srcset:
-                        img_src = srcset.split(",")[0].strip().split(" ")[0]
-                if img_src:
-                    img_src = urljoin(FANTASYLIT_URL, img_src)
-            author = ""
-            author_el = await el.query_selector(".post-content .post-block .author-detail a[rel='author'], .post-meta a[rel='author']")
-            if author_el:
-                try:
-                    author = (await author_el.inner_text()).strip()
-                except:
-                    author = ""
-            if not author:
-                p_el = await el.query_selector(".excerpt.entry-summary p")
-                if p_el:
-                    text = (await p_el.inner_text()) or ""
-                    m = re.search(r"\bby\s+([A-Z][\w\s\-\.'’]+)", text)
-                    if m:
-                        author = m.group(1).strip()
-            date_meta = ""
-            meta_el = await el.query_selector(".post-meta .meta-info, .post-meta")
-            if meta_el:
-                date_meta = (await meta_el.inner_text()).strip()
-                date_meta = re.sub(r"\s+", " ", date_meta)
-            excerpt = ""
-            excerpt_el = await el.query_selector(".excerpt.entry-summary p")
-            if excerpt_el:
-                excerpt = (await excerpt_el.inner_text()).strip()
-            books.append({
-                "publisher": "Fantasy Literature",
-                "title": title,
-                "author": author,
-                "price": "N/A",
-                "image": img_src,
-                "link": link,
-                "date_meta": date_meta,
-                "excerpt": excerpt,
-                "description": ""
-            })
-            print(f"[FantasyLit] {idx}. {title} — image: {bool(img_src)} — author: {author or 'N/A'}")
+            await asyncio.sleep(spec.get("scroll_pause_s", 1.0))
+        containers = await page.query_selector_all(spec["container"])
+        for el in containers:
+            book = {"publisher": name}
+            for field, fspec in spec["fields"].items():
+                book[field] = await extract_field(el, fspec, url)
+            book.update(spec.get("constants", {}))
+            book.setdefault("description", "")
+            books.append(book)
+        print(f"[{tag}] Found {len(books)} items")
     except PWTimeout:
-        print("Timeout while loading Fantasy Literature.")
-    except Exception as e:
-        print("Error scraping Fantasy Literature:", e)
+        print(f"Timeout while loading {name} ({budget_ms / 1000:.0f}s budget).")
+        raise
     finally:
         await page.close()
     return books
@@ -523,21 +491,41 @@ h1 { text-align:center; color:#2c3e50; }
 # ======================
 # Runner wrapper and mapping
 # ======================
+def _serve_cached(name, reason):
+    books, at = health.last_good(name)
+    if books:
+        age_h = (time.time() - at) / 3600.0
+        print(f"[Runner] {name}: {reason}, serving {len(books)} cached books from {age_h:.1f}h ago")
+    else:
+        print(f"[Runner] {name}: {reason}, no cached result to serve")
+    return books
+
+async def scrape_with_health(context, name, spec):
+    """
+    scrape_publisher with the publisher's adaptive timeout and circuit breaker
+    (publisher_health.py). A skipped, failed or empty scrape returns the
+    publisher's last good result instead.
+    """
+    if not health.allow(name):
+        return _serve_cached(name, "circuit open")
+    timeout_ms = health.timeout_ms(name, spec.get("timeout_ms", DEFAULT_TIMEOUT_MS))
+    timings = {}
+    try:
+        books = await scrape_publisher(context, name, spec, timeout_ms=timeout_ms, timings=timings)
+    except Exception as e:
+        print(f"[Runner] error scraping {name}: {e}")
+        health.record_failure(name, e)
+        return _serve_cached(name, "scrape failed")
+    # the adaptive budget covers the page load, so only that is recorded (not scrolls / extraction)
+    health.record_success(name, timings["load_s"], books)
+    return books or _serve_cached(name, "no items found")
 
-# Map human-readable publisher names to scraper functions
-SCRAPERS_MAP = {
-    "Baazh Book": scrape_baazh,
-    "Porteghaal": scrape_porteghaal,
-    "Tandis Pub": scrape_tandis,
-    "Tor Books": scrape_tor,
-    "DAW Books": scrape_daw,
-    "Fantasy Literature": scrape_fantasylit,
-}
 
 async def run_for(publishers: list, receiver_email: str, per_publisher: int = 3):
     """
     Run scrapers for the requested publishers and send email to receiver_email.
-    publishers: list of publisher names which must match keys in SCRAPERS_MAP.
+    publishers: list of publisher names which must match keys in publishers.json.
+    Returns the list of collected books (used to update the recommender index).
     """
     global RECEIVER_EMAIL
     prev_receiver = RECEIVER_EMAIL
@@ -547,15 +535,13 @@ async def run_for(publishers: list, receiver_email: str, per_publisher: int = 3)
         browser = await p.chromium.launch(headless=True)
         context = await browser.new_context(viewport={"width":1280,"height":800})
 
+        # one snapshot of the definitions for the whole run
+        definitions = load_publishers()
         all_books = []
         for name in publishers:
-            fn = SCRAPERS_MAP.get(name)
-            if fn:
-                try:
-                    books = await fn(context)
-                    all_books += books
-                except Exception as e:
-                    print(f"[Runner] error scraping {name}: {e}")
+            spec = definitions.get(name)
+            if spec:
+                all_books += await scrape_with_health(context, name, spec)
             else:
                 print(f"[Runner] unknown publisher requested: {name}")
 
@@ -571,13 +557,14 @@ async def run_for(publishers: list, receiver_email: str, per_publisher: int = 3)
         await browser.close()
 
     RECEIVER_EMAIL = prev_receiver
+    return all_books
 
 # ======================
 # Main: allow running standalone
 # ======================
 async def main():
     # default run: all publishers; sends to configured RECEIVER_EMAIL
-    all_pubs = list(SCRAPERS_MAP.keys())
+    all_pubs = publisher_names()
     await run_for(all_pubs, RECEIVER_EMAIL)
 
 if __name__ == "__main__":
@@ -0,0 +1,159 @@
+"""
+catalog.py
+Compact in-memory representation of Books.csv for the recommender.
+
+Instead of keeping a pandas DataFrame of Python strings (plus a concatenated
+`description` column) alive for the whole process, the catalog stores:
+  - all titles UTF-8 encoded in one bytes buffer, with an int64 offsets array
+  - authors and publishers as integer codes into lists of interned strings
+Rows are read back in O(1) with `catalog.row(i)`.
+
+Usage (memory benchmark, old DataFrame layout vs Catalog):
+    python catalog.py bench --csv Books.csv
+"""
+
+import argparse
+import gc
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+CSV_COLUMNS = ["Book-Title", "Book-Author", "Publisher"]
+
+
+def read_books_csv(path):
+    books_df = pd.read_csv(
+        path, usecols=CSV_COLUMNS, on_bad_lines="skip", encoding="latin-1", low_memory=False, dtype=str
+    )
+    return books_df[CSV_COLUMNS].dropna()
+
+
+class Catalog:
+    def __init__(self, titles, authors, publishers):
+        encoded = [t.encode("utf-8") for t in titles]
+        self._offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(b) for b in encoded], out=self._offsets[1:])
+        self._titles = b"".join(encoded)
+        del encoded
+
+        authors = pd.Categorical(authors)
+        publishers = pd.Categorical(publishers)
+        self._author_codes = np.asarray(authors.codes)
+        self._authors = [sys.intern(a) for a in authors.categories]
+        self._publisher_codes = np.asarray(publishers.codes)
+        self._publishers = [sys.intern(p) for p in publishers.categories]
+
+    @classmethod
+    def from_csv(cls, path):
+        books_df = read_books_csv(path)
+        catalog = cls(books_df["Book-Title"], books_df["Book-Author"], books_df["Publisher"])
+        del books_df
+        gc.collect()
+        return catalog
+
+    def __len__(self):
+        return self._offsets.shape[0] - 1
+
+    def title(self, i):
+        return self._titles[self._offsets[i]:self._offsets[i + 1]].decode("utf-8")
+
+    def author(self, i):
+        return self._authors[self._author_codes[i]]
+
+    def publisher(self, i):
+        return self._publishers[self._publisher_codes[i]]
+
+    def row(self, i):
+        return {"title": self.title(i), "author": self.author(i), "publisher": self.publisher(i)}
+
+    def iter_fields(self):
+        for i in range(len(self)):
+            yield self.title(i), self.author(i), self.publisher(i)
+
+    def nbytes(self):
+        """Approximate size of the catalog's own data (buffers + category strings)."""
+        return (
+            len(self._titles) + self._offsets.nbytes
+            + self._author_codes.nbytes + self._publisher_codes.nbytes
+            + sum(sys.getsizeof(s) for s in self._authors)
+            + sum(sys.getsizeof(s) for s in self._publishers)
+        )
+
+
+# ---------------------------
+# Memory benchmark
+# ---------------------------
+def _rss_bytes():
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+
+def _measure(mode, csv_path):
+    """Load the catalog in one layout and report resident memory (run in a fresh process)."""
+    # import libraries before the baseline so their code isn't counted
+    import recommender
+    from sklearn.feature_extraction.text import TfidfVectorizer
+
+    gc.collect()
+    before = _rss_bytes()
+    t0 = time.perf_counter()
+    if mode == "dataframe":
+        # layout used before: full DataFrame + concatenated description kept alive
+        books_df = read_books_csv(csv_path)
+        books_df["description"] = (
+            books_df["Book-Title"] + " " + books_df["Book-Author"] + " " + books_df["Publisher"]
+        )
+        tfidf_matrix = TfidfVectorizer(stop_words="english").fit_transform(books_df["description"])
+        data_bytes = int(books_df.memory_usage(deep=True).sum())
+    else:
+        catalog = Catalog.from_csv(csv_path)
+        index = recommender.BookIndex(catalog)
+        data_bytes = catalog.nbytes()
+    load_s = time.perf_counter() - t0
+    gc.collect()
+    # tfidf_matrix / index stay referenced until here on purpose: they are part of the footprint
+    after = _rss_bytes()
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    print(json.dumps({
+        "mode": mode, "rss_delta": after - before, "peak_rss": peak,
+        "data_bytes": data_bytes, "load_s": load_s,
+    }))
+
+
+def benchmark(csv_path):
+    mb = 1024.0 * 1024.0
+    print(f"{'layout':>10} {'RSS delta MB':>13} {'peak RSS MB':>12} {'data MB':>9} {'load s':>7}")
+    for mode in ("dataframe", "catalog"):
+        out = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "_measure", "--mode", mode, "--csv", csv_path],
+            check=True, capture_output=True, text=True,
+        ).stdout
+        r = json.loads(out.strip().splitlines()[-1])
+        print(f"{mode:>10} {r['rss_delta'] / mb:>13.1f} {r['peak_rss'] / mb:>12.1f} "
+              f"{r['data_bytes'] / mb:>9.1f} {r['load_s']:>7.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Books.csv catalog memory benchmark.")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    b = sub.add_parser("bench", help="Compare resident memory of the DataFrame and Catalog layouts.")
+    b.add_argument("--csv", default="Books.csv")
+    m = sub.add_parser("_measure")
+    m.add_argument("--mode", choices=["dataframe", "catalog"], required=True)
+    m.add_argument("--csv", default="Books.csv")
+    args = parser.parse_args()
+
+    if args.cmd == "bench":
+        benchmark(args.csv)
+    else:
+        _measure(args.mode, args.csv)
+
+
+if __name__ == "__main__":
+    main()
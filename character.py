@@ -20,15 +20,17 @@ en_nlp = spacy.load("en_core_web_sm")
 # ---------------------------
 def extract_persian_names(text):
     doc = fa_nlp(text)
-    names = set()
+    names = []
 
     for ent in doc.ents:
         if ent.type == 'pers':
             # If name has surname, we keep only first part to avoid duplication
             name = ent.text.split()[0]
-            names.add(name)
+            names.append(name)
 
-    return list(names)
+    # most mentioned first, like the English extractor
+    counted = Counter(names)
+    return [name for name, _ in counted.most_common()]
 
 # ---------------------------
 # English NER (spaCy)
@@ -89,6 +91,7 @@ def on_hotkey():
 if __name__ == "__main__":
     print("Press Ctrl+Shift+V to extract names (Persian or English).")
     print("Press Ctrl+C to exit.")
+    print("(For a whole book file use: python book_characters.py book.txt)")
     
     keyboard.add_hotkey("ctrl+shift+v", on_hotkey)
     keyboard.wait()
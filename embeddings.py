@@ -0,0 +1,271 @@
+"""
+embeddings.py
+Dense-embedding backend for the book recommender.
+
+Book texts (title + author + publisher) are encoded once with a small
+sentence-transformers model and stored on disk as a float16 matrix. Search
+uses an IVF (inverted file) index: vectors are clustered with spherical
+k-means and stored grouped by cluster, so a query only scans the `nprobe`
+closest clusters instead of the whole catalog. Everything runs on CPU and the
+vector file is memory-mapped, so several worker processes share one copy.
+
+Usage:
+    python embeddings.py build --csv Books.csv
+    python embeddings.py bench --queries 200 --k 10 --nprobe 4,8,16,32
+"""
+
+import argparse
+import json
+import time
+from pathlib import Path
+import threading
+
+import numpy as np
+
+import recommender
+from catalog import Catalog
+from profiling import stage
+
+try:
+    from sentence_transformers import SentenceTransformer
+except ImportError:  # dense mode is optional
+    SentenceTransformer = None
+
+# --------- Configurable defaults ----------
+EMBED_MODEL = "sentence-transformers/all-MiniLM-L6-v2"  # 384-dim, fast on CPU
+INDEX_DIR = Path("book_embeddings")
+DEFAULT_NPROBE = 16        # clusters scanned per query (recall vs latency knob)
+KMEANS_ITERS = 15
+KMEANS_SAMPLE = 50000      # rows used to train centroids
+SCAN_CHUNK_ROWS = 65536    # rows per block for exact (brute-force) search
+# ------------------------------------------
+
+
+def load_encoder(model_name=EMBED_MODEL):
+    if SentenceTransformer is None:
+        raise RuntimeError("sentence-transformers is not installed (pip install sentence-transformers)")
+    return SentenceTransformer(model_name, device="cpu")
+
+
+def encode(encoder, texts, batch_size=256):
+    vecs = encoder.encode(
+        list(texts), batch_size=batch_size, normalize_embeddings=True,
+        convert_to_numpy=True, show_progress_bar=False,
+    )
+    return np.asarray(vecs, dtype=np.float32)
+
+
+def _normalize(x):
+    norms = np.linalg.norm(x, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return x / norms
+
+
+def train_centroids(vectors, nlist, iters=KMEANS_ITERS, sample=KMEANS_SAMPLE, seed=0):
+    """Spherical k-means on a random sample of rows."""
+    rng = np.random.default_rng(seed)
+    n = vectors.shape[0]
+    x = vectors[rng.choice(n, size=min(sample, n), replace=False)].astype(np.float32)
+    centroids = x[rng.choice(x.shape[0], size=nlist, replace=False)].copy()
+    for _ in range(iters):
+        assign = np.argmax(x @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assign, x)
+        counts = np.bincount(assign, minlength=nlist)
+        filled = counts > 0
+        centroids[filled] = _normalize(sums[filled])
+    return centroids
+
+
+def assign_clusters(vectors, centroids):
+    out = np.empty(vectors.shape[0], dtype=np.int64)
+    for s in range(0, vectors.shape[0], SCAN_CHUNK_ROWS):
+        block = np.asarray(vectors[s:s + SCAN_CHUNK_ROWS], dtype=np.float32)
+        out[s:s + SCAN_CHUNK_ROWS] = np.argmax(block @ centroids.T, axis=1)
+    return out
+
+
+def build_index(texts, out_dir=INDEX_DIR, model_name=EMBED_MODEL, nlist=None):
+    """Encode texts and write the IVF index files into out_dir."""
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+
+    encoder = load_encoder(model_name)
+    t0 = time.perf_counter()
+    vecs = encode(encoder, texts)
+    print(f"Encoded {vecs.shape[0]} books in {time.perf_counter() - t0:.1f}s (dim={vecs.shape[1]})")
+
+    n = vecs.shape[0]
+    nlist = nlist or max(1, int(np.sqrt(n)))
+    centroids = train_centroids(vecs, nlist)
+    assign = assign_clusters(vecs, centroids)
+
+    # store vectors grouped by cluster so each inverted list is one contiguous slice
+    order = np.argsort(assign, kind="stable")
+    offsets = np.zeros(nlist + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum(np.bincount(assign, minlength=nlist))
+
+    np.save(out_dir / "vectors.f16.npy", vecs[order].astype(np.float16))
+    np.save(out_dir / "ids.npy", order.astype(np.int64))
+    np.save(out_dir / "offsets.npy", offsets)
+    np.save(out_dir / "centroids.npy", centroids.astype(np.float32))
+    with open(out_dir / "meta.json", "w", encoding="utf-8") as f:
+        json.dump({"model": model_name, "count": int(n), "dim": int(vecs.shape[1]), "nlist": int(nlist)}, f)
+    print(f"Saved IVF index to {out_dir} (nlist={nlist})")
+
+
+class DenseIndex:
+    """
+    Memory-mapped IVF index over the base catalog, plus a small in-memory
+    brute-force segment for books added at runtime. Row ids are the same
+    as recommender.BookIndex row ids.
+    """
+
+    def __init__(self, index_dir=INDEX_DIR, encoder=None):
+        index_dir = Path(index_dir)
+        with open(index_dir / "meta.json", encoding="utf-8") as f:
+            self.meta = json.load(f)
+        self.vectors = np.load(index_dir / "vectors.f16.npy", mmap_mode="r")
+        self.ids = np.load(index_dir / "ids.npy")
+        self.offsets = np.load(index_dir / "offsets.npy")
+        self.centroids = np.load(index_dir / "centroids.npy")
+        self.encoder = encoder or load_encoder(self.meta["model"])
+
+        self._lock = threading.Lock()
+        self._extra_vecs = np.zeros((0, self.meta["dim"]), dtype=np.float32)
+        self._extra_ids = np.zeros(0, dtype=np.int64)
+
+    @property
+    def count(self):
+        return self.meta["count"]
+
+    def encode_query(self, text):
+        with stage("dense.encode"):
+            return encode(self.encoder, [text])[0]
+
+    def add_rows(self, first_id, rows):
+        """BookIndex listener: embed newly scraped books."""
+        texts = [recommender.book_text(r["title"], r["author"], r["publisher"], r.get("excerpt", "")) for r in rows]
+        vecs = encode(self.encoder, texts)
+        ids = np.arange(first_id, first_id + len(rows), dtype=np.int64)
+        with self._lock:
+            self._extra_vecs = np.vstack([self._extra_vecs, vecs])
+            self._extra_ids = np.concatenate([self._extra_ids, ids])
+
+    def _scan_all(self, q):
+        scores = np.empty(self.vectors.shape[0], dtype=np.float32)
+        for s in range(0, self.vectors.shape[0], SCAN_CHUNK_ROWS):
+            scores[s:s + SCAN_CHUNK_ROWS] = np.asarray(self.vectors[s:s + SCAN_CHUNK_ROWS], dtype=np.float32) @ q
+        return self.ids, scores
+
+    def _scan_probes(self, q, nprobe):
+        nprobe = min(nprobe, self.centroids.shape[0])
+        probes = np.argpartition(self.centroids @ q, -nprobe)[-nprobe:]
+        ids, scores = [], []
+        for c in probes:
+            s, e = self.offsets[c], self.offsets[c + 1]
+            if e > s:
+                scores.append(np.asarray(self.vectors[s:e], dtype=np.float32) @ q)
+                ids.append(self.ids[s:e])
+        if not ids:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        return np.concatenate(ids), np.concatenate(scores)
+
+    def search_vector(self, q, top_n=3, nprobe=DEFAULT_NPROBE, exact=False):
+        with stage("dense.scan"):
+            ids, scores = self._scan_all(q) if exact else self._scan_probes(q, nprobe)
+            with self._lock:
+                extra_vecs, extra_ids = self._extra_vecs, self._extra_ids
+            if extra_ids.shape[0]:
+                ids = np.concatenate([ids, extra_ids])
+                scores = np.concatenate([scores, extra_vecs @ q])
+        top_n = min(top_n, scores.shape[0])
+        if top_n == 0:
+            return []
+        with stage("dense.sort"):
+            top = np.argpartition(scores, -top_n)[-top_n:]
+            top = top[np.argsort(scores[top])[::-1]]
+        return [(int(ids[i]), float(scores[i])) for i in top]
+
+    def search(self, keywords, top_n=3, nprobe=DEFAULT_NPROBE, exact=False):
+        return self.search_vector(self.encode_query(keywords), top_n, nprobe, exact)
+
+    def recommend(self, keywords, row, top_n=3, nprobe=DEFAULT_NPROBE):
+        """row: row-id -> book dict accessor (BookIndex.row)."""
+        results = []
+        for idx, score in self.search(keywords, top_n, nprobe):
+            book = row(idx)
+            book["score"] = score
+            results.append(book)
+        return results
+
+
+# ---------------------------
+# CLI: build / benchmark
+# ---------------------------
+def catalog_texts(csv_path):
+    return [recommender.book_text(t, a, p) for t, a, p in Catalog.from_csv(csv_path).iter_fields()]
+
+
+def _percentile_ms(samples, q):
+    return float(np.percentile(np.asarray(samples) * 1000.0, q))
+
+
+def benchmark(index, queries, k=10, nprobes=(4, 8, 16, 32)):
+    """Recall@k and latency of IVF search against exact brute-force search."""
+    t0 = time.perf_counter()
+    qvecs = encode(index.encoder, queries)
+    enc_ms = (time.perf_counter() - t0) * 1000.0 / len(queries)
+    print(f"Query encoding: {enc_ms:.2f} ms/query (not included below)")
+
+    truth, exact_times = [], []
+    for q in qvecs:
+        t0 = time.perf_counter()
+        res = index.search_vector(q, k, exact=True)
+        exact_times.append(time.perf_counter() - t0)
+        truth.append({i for i, _ in res})
+    print(f"{'mode':>10} {'recall@' + str(k):>10} {'p50 ms':>8} {'p95 ms':>8}")
+    print(f"{'exact':>10} {1.0:>10.3f} {_percentile_ms(exact_times, 50):>8.2f} {_percentile_ms(exact_times, 95):>8.2f}")
+
+    for nprobe in nprobes:
+        times, hits = [], 0
+        for q, gt in zip(qvecs, truth):
+            t0 = time.perf_counter()
+            res = index.search_vector(q, k, nprobe=nprobe)
+            times.append(time.perf_counter() - t0)
+            hits += len(gt & {i for i, _ in res})
+        recall = hits / float(sum(len(gt) for gt in truth) or 1)
+        label = f"ivf/{nprobe}"
+        print(f"{label:>10} {recall:>10.3f} {_percentile_ms(times, 50):>8.2f} {_percentile_ms(times, 95):>8.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Dense embedding index for the book recommender.")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+
+    b = sub.add_parser("build", help="Encode Books.csv and build the IVF index.")
+    b.add_argument("--csv", default="Books.csv")
+    b.add_argument("--out", default=str(INDEX_DIR))
+    b.add_argument("--model", default=EMBED_MODEL)
+    b.add_argument("--nlist", type=int, help="Number of IVF clusters (default: sqrt(N)).")
+
+    r = sub.add_parser("bench", help="Recall vs latency of IVF search against exact search.")
+    r.add_argument("--csv", default="Books.csv")
+    r.add_argument("--index", default=str(INDEX_DIR))
+    r.add_argument("--queries", type=int, default=200, help="Number of sampled book texts used as queries.")
+    r.add_argument("--k", type=int, default=10)
+    r.add_argument("--nprobe", default="4,8,16,32", help="Comma-separated nprobe values.")
+    args = parser.parse_args()
+
+    if args.cmd == "build":
+        build_index(catalog_texts(args.csv), args.out, args.model, args.nlist)
+    else:
+        texts = catalog_texts(args.csv)
+        rng = np.random.default_rng(0)
+        queries = [texts[i] for i in rng.choice(len(texts), size=min(args.queries, len(texts)), replace=False)]
+        index = DenseIndex(args.index)
+        benchmark(index, queries, args.k, [int(x) for x in args.nprobe.split(",")])
+
+
+if __name__ == "__main__":
+    main()
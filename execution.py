@@ -0,0 +1,506 @@
+# execution.py
+# Execution layer for the NLP endpoints.
+#
+# Model inference holds the GIL, so running it on request threads lets one long
+# summarization stall every other request in the same process. Here it is
+# dispatched instead:
+#   - model batches run in a pool of inference processes forked from the
+#     server process, so they inherit the models already loaded (copy-on-write)
+#     and compute outside the server's GIL. The micro-batchers of /summarize and
+#     /extract-names stay in the server process, where concurrent requests meet,
+#     and hand each finished batch to run_batch() (app.py wires this up)
+#   - "thread" endpoints run the request's own code (chunking, routing, waiting
+#     for batches, /recommend's search) on a thread pool of their own in the
+#     server process, so its deadline can be enforced; /recommend stays in-process because its
+#     index is updated live by /subscribe
+#   - "stream" endpoints (/summarize/stream) run a generator in a dedicated
+#     stream process and relay its items back over a pipe
+# Every endpoint has its own concurrency limit and queue. A full endpoint
+# queue answers 429; a process pool whose backlog is already POOL_BACKLOG
+# batches per process answers 503; a request whose deadline passes, while
+# queued or running, answers 504. serve.py sizes gunicorn's request threads as
+# request_slots() + LIGHT_THREADS, so LIGHT_THREADS threads are always left
+# for /publishers, /subscribe and the static page.
+#
+# Processes are only forked in start(), before the server starts any thread.
+# One that dies later is replaced with a spawned process, which loads the
+# models again instead of forking a process whose locks may be held.
+
+import contextvars
+import multiprocessing
+import os
+import signal
+import threading
+import time
+import weakref
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeout
+from concurrent.futures.process import BrokenProcessPool
+
+import profiling
+
+EndpointConfig = namedtuple("EndpointConfig", "limit queue deadline where")
+
+
+def _config(name, limit, queue, deadline, where):
+    # e.g. SUMMARIZE_LIMIT=4 EXTRACT_NAMES_DEADLINE_S=10
+    key = name.upper().replace("-", "_")
+    return EndpointConfig(
+        limit=int(os.environ.get(f"{key}_LIMIT", limit)),
+        queue=int(os.environ.get(f"{key}_QUEUE", queue)),
+        deadline=float(os.environ.get(f"{key}_DEADLINE_S", deadline)),
+        where=where,
+    )
+
+
+# --------- Configurable defaults ----------
+NLP_PROCESSES = int(os.environ.get("NLP_PROCESSES", 2))   # inference processes per server process
+POOL_BACKLOG = int(os.environ.get("POOL_BACKLOG", 2))     # queued batches per process before 503
+LIGHT_THREADS = int(os.environ.get("LIGHT_THREADS", 4))   # request threads kept for light routes
+ENDPOINTS = {
+    # name: concurrency limit, queue depth, deadline (s), where it runs
+    # (the limits of the batched endpoints are what the micro-batchers can group)
+    "summarize": _config("summarize", 8, 8, 120.0, "thread"),
+    "extract-names": _config("extract-names", 16, 16, 30.0, "thread"),
+    "recommend": _config("recommend", 2, 8, 5.0, "thread"),
+    # one stream process per unit of limit
+    "summarize-stream": _config("summarize-stream", 1, 2, 120.0, "stream"),
+}
+# ------------------------------------------
+
+
+def request_slots(endpoints=ENDPOINTS):
+    """Request threads the NLP endpoints can occupy at most (running + queued)."""
+    return sum(c.limit + c.queue for c in endpoints.values())
+
+
+class Rejected(Exception):
+    status = 503
+    retry_after = 1
+
+
+class Overloaded(Rejected):
+    """The process pool already has POOL_BACKLOG batches per process waiting."""
+    status = 503
+
+
+class QueueFull(Rejected):
+    """The endpoint is at its concurrency limit and its queue is full."""
+    status = 429
+
+
+class DeadlineExceeded(Rejected):
+    """The request's deadline passed while it was queued or running."""
+    status = 504
+    retry_after = None
+
+
+# ---------------------------
+# Worker-process side
+# ---------------------------
+_in_child = False   # True in inference / stream processes: run_batch() runs batches right there
+
+
+def _init_child(torch_threads, parent_pid):
+    global _in_child
+    _in_child = True
+    # the server's signal handlers (gunicorn's included) make no sense here
+    for sig in (signal.SIGTERM, signal.SIGQUIT, signal.SIGHUP, signal.SIGUSR1, signal.SIGUSR2, signal.SIGWINCH):
+        signal.signal(sig, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)   # Ctrl-C goes to the server, which shuts us down
+    if torch_threads:
+        try:
+            import torch
+            torch.set_num_threads(torch_threads)
+        except ImportError:
+            pass
+
+    def watch_parent():
+        # exit if the server process is killed without shutting the pool down
+        while os.getppid() == parent_pid:
+            time.sleep(1.0)
+        os._exit(0)
+
+    threading.Thread(target=watch_parent, name="parent-watch", daemon=True).start()
+
+
+def _call_before(deadline, fn, args, kwargs):
+    # a task that waited in the pool's queue past its deadline is not worth running
+    if time.monotonic() >= deadline:
+        raise DeadlineExceeded("deadline passed before the task started")
+    return fn(*args, **kwargs)
+
+
+def _call_in_child(deadline, fn, args, kwargs, sampled, stacks):
+    # stage timings and stack samples travel back with the result (profiling.py)
+    if time.monotonic() >= deadline:
+        raise DeadlineExceeded("deadline passed before the task started")
+    return profiling.run_captured(fn, args, kwargs, sampled, stacks)
+
+
+def _stream_loop(conn, torch_threads, parent_pid):
+    """Stream process: run (fn, args, kwargs) tasks and send every item fn yields."""
+    _init_child(torch_threads, parent_pid)
+    while True:
+        try:
+            fn, args, kwargs = conn.recv()
+        except EOFError:
+            os._exit(0)
+        try:
+            for item in fn(*args, **kwargs):
+                conn.send(("item", item))
+            conn.send(("end", None))
+        except Exception as e:
+            conn.send(("error", f"{type(e).__name__}: {e}"))
+
+
+# ---------------------------
+# Server side
+# ---------------------------
+class _Endpoint:
+    def __init__(self, name, config):
+        self.name = name
+        self.config = config
+        self.cond = threading.Condition()
+        self.running = 0
+        self.waiting = 0
+        self.stats = {"ok": 0, "error": 0, "429": 0, "503": 0, "504": 0}
+
+    def enter(self, deadline):
+        with self.cond:
+            if self.running >= self.config.limit:
+                if self.waiting >= self.config.queue:
+                    self.stats["429"] += 1
+                    raise QueueFull(f"{self.name}: {self.running} running, {self.waiting} queued")
+                self.waiting += 1
+                try:
+                    while self.running >= self.config.limit:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            self.stats["504"] += 1
+                            raise DeadlineExceeded(f"{self.name}: deadline passed while queued")
+                        self.cond.wait(remaining)
+                finally:
+                    self.waiting -= 1
+            self.running += 1
+
+    def leave(self):
+        with self.cond:
+            self.running -= 1
+            self.cond.notify()
+
+
+class _Streamer:
+    """One stream process and the server's end of its pipe."""
+
+    def __init__(self, ctx, torch_threads):
+        self.conn, child_conn = ctx.Pipe()
+        self.process = ctx.Process(target=_stream_loop, args=(child_conn, torch_threads, os.getpid()),
+                                   name="stream", daemon=True)
+        self.process.start()
+        child_conn.close()
+
+    def discard(self):
+        self.conn.close()
+        if self.process.is_alive():
+            self.process.kill()
+
+
+class Stream:
+    """
+    Items of one streamed task, relayed from a stream process. Iterate it, and
+    call close() when the response ends (also if it was never iterated): a
+    task that is still running is drained in the background before its
+    process and endpoint slot are given back.
+    """
+
+    def __init__(self, layer, ep, streamer, deadline, budget, task):
+        self._layer = layer
+        self._ep = ep
+        self._streamer = streamer
+        self._deadline = deadline
+        self._budget = budget
+        self._task = task
+        self._sent = False
+        self._done = False
+        self._closed = False
+
+    def __iter__(self):
+        conn = self._streamer.conn
+        if not self._sent:
+            conn.send(self._task)
+            self._sent = True
+        while not self._done:
+            remaining = self._deadline - time.monotonic()
+            try:
+                if remaining <= 0 or not conn.poll(remaining):
+                    self._ep.stats["504"] += 1
+                    raise DeadlineExceeded(f"{self._ep.name}: stream not finished within {self._budget:.1f}s")
+                kind, value = conn.recv()
+            except (EOFError, OSError):
+                self._done = True
+                self._ep.stats["503"] += 1
+                self._streamer = self._layer._replace_streamer(self._streamer)
+                raise Overloaded("stream process died, restarting it")
+            if kind == "item":
+                yield value
+            elif kind == "end":
+                self._done = True
+                self._ep.stats["ok"] += 1
+            else:
+                self._done = True
+                self._ep.stats["error"] += 1
+                raise RuntimeError(value)
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        if self._sent and not self._done:
+            threading.Thread(target=self._drain, name="stream-drain", daemon=True).start()
+        else:
+            self._layer._release_streamer(self._ep, self._streamer)
+
+    def _drain(self):
+        try:
+            while self._streamer.conn.recv()[0] == "item":
+                pass
+        except (EOFError, OSError):
+            self._streamer = self._layer._replace_streamer(self._streamer)
+        self._layer._release_streamer(self._ep, self._streamer)
+
+
+# every layer starts over in a forked child (gunicorn workers, inference processes):
+# pools and threads do not survive fork. One hook for all of them; the set does
+# not keep dead layers alive
+_layers = weakref.WeakSet()
+
+
+def _reset_after_fork():
+    for layer in list(_layers):
+        layer._reset()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+class ExecutionLayer:
+    def __init__(self, endpoints=ENDPOINTS, processes=NLP_PROCESSES, backlog=POOL_BACKLOG):
+        self.configs = dict(endpoints)
+        self.processes = max(1, int(processes))
+        self.backlog = max(0, int(backlog))
+        self.stream_processes = sum(c.limit for c in self.configs.values() if c.where == "stream")
+        self._reset()
+        _layers.add(self)
+
+    def _reset(self):
+        self.endpoints = {name: _Endpoint(name, c) for name, c in self.configs.items()}
+        self._lock = threading.Lock()
+        self._pool = None
+        self._threads = {}     # endpoint name -> its thread pool
+        self._streamers = []   # idle stream processes
+        self._inflight = 0
+        self._torch_threads = None
+        self._forking = False
+
+    # --- pools ---
+    def start(self, torch_threads=None):
+        """
+        Fork the stream and inference processes now. Call this before the
+        server starts its own threads (serve.py does it in post_worker_init):
+        forking a process that has other threads running is what breaks locks.
+        Processes created after start() returns are spawned instead.
+        """
+        self._torch_threads = torch_threads or max(1, multiprocessing.cpu_count() // self.processes)
+        self._forking = True
+        try:
+            # stream processes first: the process pool starts a management thread
+            ctx = self._context()
+            self._streamers = [_Streamer(ctx, self._torch_threads) for _ in range(self.stream_processes)]
+            pool = self._get_pool()
+            # fork-context pools start all processes on the first submit
+            pool.submit(os.getpid).result()
+        finally:
+            self._forking = False
+        return self
+
+    def _context(self):
+        if self._forking:
+            return multiprocessing.get_context("fork")   # inherit the loaded models
+        print("[Execution] spawning a process after start(): it loads the models again")
+        return multiprocessing.get_context("spawn")
+
+    def _get_pool(self):
+        with self._lock:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.processes,
+                    mp_context=self._context(),
+                    initializer=_init_child,
+                    initargs=(self._torch_threads, os.getpid()),
+                )
+            return self._pool
+
+    def _get_threads(self, name):
+        # one pool per endpoint, sized to its limit: threads still running past
+        # their deadline (a result nobody waits for) only hold up their own endpoint
+        with self._lock:
+            if name not in self._threads:
+                self._threads[name] = ThreadPoolExecutor(max_workers=max(1, self.configs[name].limit),
+                                                         thread_name_prefix=f"exec-{name}")
+            return self._threads[name]
+
+    def _submit_process(self, deadline, fn, args, kwargs):
+        with self._lock:
+            if self._inflight >= self.processes * (1 + self.backlog):
+                raise Overloaded(f"{self._inflight} tasks in flight for {self.processes} processes")
+            self._inflight += 1
+        try:
+            fut = self._get_pool().submit(_call_in_child, deadline, fn, args, kwargs,
+                                          profiling.current() is not None, profiling.profiler.sampler.enabled)
+        except BrokenProcessPool:
+            self._task_done(None)
+            self._drop_pool()
+            raise Overloaded("inference process died, restarting the pool")
+        fut.add_done_callback(self._task_done)
+        return fut
+
+    def _task_done(self, _fut):
+        with self._lock:
+            self._inflight -= 1
+
+    def _drop_pool(self):
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    def _take_streamer(self):
+        with self._lock:
+            if self._streamers:
+                return self._streamers.pop()
+        # start() was not called
+        return _Streamer(self._context(), self._torch_threads)
+
+    def _release_streamer(self, ep, streamer):
+        with self._lock:
+            self._streamers.append(streamer)
+        ep.leave()
+
+    def _replace_streamer(self, streamer):
+        streamer.discard()
+        return _Streamer(self._context(), self._torch_threads)
+
+    # --- requests ---
+    def budget(self, name, timeout=None):
+        """Seconds a request of endpoint `name` may take: timeout can only shorten its deadline."""
+        deadline = self.configs[name].deadline
+        return deadline if timeout is None else min(timeout, deadline)
+
+    def run(self, name, fn, *args, timeout=None, where=None, **kwargs):
+        """
+        Run fn(*args, **kwargs) for endpoint `name` and wait for the result.
+        timeout (seconds) can only shorten the endpoint's deadline. where
+        overrides the endpoint's default: "process", "thread" or "inline"
+        (on the request thread, admission control only). Process tasks are
+        pickled by reference, so fn must be a module-level function.
+        Raises QueueFull (429), Overloaded (503) or DeadlineExceeded (504).
+        """
+        ep = self.endpoints[name]
+        budget = self.budget(name, timeout)
+        deadline = time.monotonic() + budget
+        with profiling.stage(f"{name}.admission"):
+            ep.enter(deadline)   # counts its own 429 / 504
+        try:
+            with profiling.stage(f"{name}.{where or ep.config.where}"):
+                result = self._dispatch(name, where or ep.config.where, deadline, budget, fn, args, kwargs)
+        except Rejected as e:
+            ep.stats[str(e.status)] += 1
+            raise
+        except Exception:
+            ep.stats["error"] += 1
+            raise
+        finally:
+            ep.leave()
+        ep.stats["ok"] += 1
+        return result
+
+    def _dispatch(self, name, where, deadline, budget, fn, args, kwargs):
+        if where == "inline":
+            return fn(*args, **kwargs)
+        if where == "process":
+            fut = self._submit_process(deadline, fn, args, kwargs)
+        else:
+            # copy the context so the request's profile follows it to the pool thread
+            fut = self._get_threads(name).submit(contextvars.copy_context().run, _call_before, deadline, fn, args, kwargs)
+        return self._wait(name, where, fut, deadline, budget)
+
+    def _wait(self, name, where, fut, deadline, budget):
+        try:
+            result = fut.result(timeout=max(0.0, deadline - time.monotonic()))
+            if where == "process":
+                result, stages, stacks = result
+                profiling.merge_captured(stages, stacks)
+            return result
+        except FutureTimeout:
+            fut.cancel()   # still queued: never runs; already running: the result is dropped
+            raise DeadlineExceeded(f"{name}: no result within {budget:.1f}s")
+        except BrokenProcessPool:
+            self._drop_pool()
+            raise Overloaded("inference process died, restarting the pool")
+
+    def run_batch(self, name, fn, *args, **kwargs):
+        """
+        Run one micro-batch, fn(*args, **kwargs), in an inference process and
+        wait for it (called by a batcher thread, see app.py), within endpoint
+        `name`'s deadline. In an inference or stream process fn runs right
+        there. Raises Overloaded (503) or DeadlineExceeded (504), which the
+        batcher passes on to every request in the batch.
+        """
+        if _in_child:
+            return fn(*args, **kwargs)
+        budget = self.configs[name].deadline
+        deadline = time.monotonic() + budget
+        with profiling.stage(f"{name}.process"):
+            fut = self._submit_process(deadline, fn, args, kwargs)
+            return self._wait(name, "process", fut, deadline, budget)
+
+    def stream(self, name, fn, *args, timeout=None, **kwargs):
+        """
+        Run generator fn(*args, **kwargs) for stream endpoint `name` in a
+        stream process; returns a Stream of its items. Admission happens here,
+        so QueueFull (429) and a queue-time DeadlineExceeded (504) are raised
+        before the response starts. fn must be a module-level function.
+        """
+        ep = self.endpoints[name]
+        budget = self.budget(name, timeout)
+        deadline = time.monotonic() + budget
+        ep.enter(deadline)
+        try:
+            streamer = self._take_streamer()
+        except Exception:
+            ep.leave()
+            raise
+        return Stream(self, ep, streamer, deadline, budget, (fn, args, kwargs))
+
+    def admit(self, name):
+        """
+        Take a slot of endpoint `name` for work that runs on the request thread;
+        returns the function that gives it back.
+        """
+        ep = self.endpoints[name]
+        ep.enter(time.monotonic() + ep.config.deadline)
+        return ep.leave
+
+    def stats(self):
+        return {
+            "processes": self.processes,
+            "in_flight": self._inflight,
+            "stream_processes": self.stream_processes,
+            "idle_stream_processes": len(self._streamers),
+            "endpoints": {
+                name: dict(ep.stats, running=ep.running, waiting=ep.waiting, **ep.config._asdict())
+                for name, ep in self.endpoints.items()
+            },
+        }
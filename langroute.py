@@ -0,0 +1,144 @@
+"""
+langroute.py
+Fast language routing for name extraction (Persian -> Stanza, English -> spaCy).
+
+Instead of running langdetect over the whole input, the router counts
+Arabic-script vs Latin letters. The only Arabic-script model is Persian, so
+Arabic-script text always goes to "fa" (short Persian, or Persian typed with
+Arabic ي/ك, has no Persian-only letters and langdetect would call it Urdu or
+Arabic). detect_language() only looks at a bounded sample (start, middle and
+end of the text); split_by_language() checks the whole text for each script
+(one regex search each) and splits any text containing both into
+per-language segments, so a Persian paragraph inside an English book still
+goes to the Persian model. langdetect (seeded, so it is deterministic) only
+breaks ties, for a piece with as many letters of each script.
+
+Usage (routing cost, langdetect vs this router):
+    python langroute.py bench
+"""
+
+import argparse
+import re
+import time
+
+from langdetect import DetectorFactory, detect, detect_langs
+
+DetectorFactory.seed = 0   # langdetect is random otherwise
+
+# --------- Configurable defaults ----------
+SAMPLE_CHARS = 3000
+MIXED_LOW = 0.1    # Arabic-script share of letters below this -> English
+MIXED_HIGH = 0.9   # above this -> Persian; in between -> mixed
+# ------------------------------------------
+
+_ARABIC = re.compile("[\u0620-\u064A\u066E-\u06D3\u06FA-\u06FF\u0750-\u077F\u08A0-\u08FF\uFB50-\uFDFF\uFE70-\uFEFC]")
+_LATIN = re.compile("[A-Za-z\u00C0-\u024F]")
+_PIECE = re.compile(r"[^.!?؟\n]+[.!?؟\n]*|[.!?؟\n]+")
+
+
+def _sample(text, n=SAMPLE_CHARS):
+    if len(text) <= n:
+        return text
+    k = n // 3
+    mid = len(text) // 2
+    return text[:k] + " " + text[mid - k // 2:mid + k // 2] + " " + text[-k:]
+
+
+def _script_counts(text):
+    return len(_ARABIC.findall(text)), len(_LATIN.findall(text))
+
+
+def _tiebreak(text):
+    """fa or en for a piece with as many Arabic-script as Latin letters."""
+    try:
+        for guess in detect_langs(text):
+            if guess.lang in ("fa", "ar", "ur"):
+                return "fa"
+            if guess.lang == "en":
+                return "en"
+    except Exception:
+        pass
+    return "en"
+
+
+def detect_language(text):
+    """Return "fa", "en", "mixed" or "unknown" (the languages with a model, by script)."""
+    sample = _sample(text)
+    arabic, latin = _script_counts(sample)
+    if arabic + latin == 0:
+        return "unknown"
+    share = arabic / float(arabic + latin)
+    if share <= MIXED_LOW:
+        return "en"
+    if share < MIXED_HIGH:
+        return "mixed"
+    return "fa"
+
+
+def split_by_language(text):
+    """
+    [(lang, start_offset, segment)] for text. Text in a single script is one
+    segment; text containing both, however little of one, is split on
+    sentence / line boundaries and adjacent pieces of the same script are
+    merged.
+    """
+    has_arabic, has_latin = _ARABIC.search(text) is not None, _LATIN.search(text) is not None
+    if not (has_arabic and has_latin):
+        return [("fa" if has_arabic else "en" if has_latin else "unknown", 0, text)]
+
+    segments = []   # [lang, start, end]
+    for m in _PIECE.finditer(text):
+        arabic, latin = _script_counts(m.group())
+        if arabic == latin == 0:
+            piece_lang = segments[-1][0] if segments else None   # punctuation / numbers stick to the previous piece
+        elif arabic == latin:
+            piece_lang = _tiebreak(m.group())
+        else:
+            piece_lang = "fa" if arabic > latin else "en"
+        if segments and (piece_lang is None or segments[-1][0] == piece_lang):
+            segments[-1][2] = m.end()
+        elif piece_lang is None:
+            segments.append(["unknown", m.start(), m.end()])
+        else:
+            segments.append([piece_lang, m.start(), m.end()])
+    return [(lang, start, text[start:end]) for lang, start, end in segments if text[start:end].strip()]
+
+
+# ---------------------------
+# Benchmark
+# ---------------------------
+def benchmark(repeat=50):
+    en = "Harry looked at Hermione while Ron argued with Professor McGonagall about the dragon. "
+    fa = "ناهید با قدم‌های آهسته وارد کوچه‌ی باریک شد و سامان کنار چراغ خاموش ایستاده بود. "
+    cases = {
+        "en 1KB": en * 12, "fa 1KB": fa * 6,
+        "en 100KB": en * 1200, "fa 100KB": fa * 600,
+        "mixed 10KB": (en + fa) * 40,
+    }
+    print(f"{'text':>11} {'langdetect ms':>14} {'router ms':>10} {'router says':>12}")
+    for name, text in cases.items():
+        t0 = time.perf_counter()
+        for _ in range(repeat):
+            try:
+                detect(text)
+            except Exception:
+                pass
+        ld_ms = (time.perf_counter() - t0) * 1000.0 / repeat
+        t0 = time.perf_counter()
+        for _ in range(repeat):
+            lang = detect_language(text)
+        rt_ms = (time.perf_counter() - t0) * 1000.0 / repeat
+        print(f"{name:>11} {ld_ms:>14.2f} {rt_ms:>10.3f} {lang:>12}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Language router benchmark.")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    b = sub.add_parser("bench")
+    b.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+    benchmark(args.repeat)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+"""
+loadtest.py
+Closed-loop load test for the API (standard library only).
+
+Each client thread keeps one keep-alive connection and sends requests back to
+back, picking the route from a weighted mix. At the end it prints, per route
+and overall, requests/second and latency percentiles (p50 / p95 / p99), and
+how many requests were turned away by the execution layer (429 endpoint
+queue full, 503 inference processes backed up, 504 deadline passed) or failed.
+
+Summaries are cached (summary_cache.py), so by default every /summarize text
+is made unique; pass --cacheable to measure the cache-hit path instead.
+
+Usage:
+    python loadtest.py --url http://localhost:5000 --duration 30 --clients 16
+    python loadtest.py --mix publishers=8,recommend=4,extract-names=2,summarize=1
+"""
+
+import argparse
+import http.client
+import itertools
+import json
+import math
+import random
+import threading
+import time
+from collections import Counter
+from urllib.parse import urlparse
+
+SUMMARY_TEXT = (
+    "The kingdom of Eldoria had been at peace for a hundred years, until a dragon appeared above the "
+    "northern mountains. Princess Lyra, who had trained in secret with the royal guard, rode out with a "
+    "small company to find the ancient sword said to be hidden in the Whispering Woods. Along the way they "
+    "met a wandering mage, crossed a river guarded by spirits and discovered that the dragon was bound to "
+    "the sword by an old curse. In the end Lyra broke the curse instead of slaying the dragon, and the "
+    "creature became the guardian of the realm."
+)
+NER_TEXT = "Harry looked at Hermione while Ron argued with Professor McGonagall about the dragon."
+KEYWORDS = ["dragon magic", "space opera", "detective london", "vampire romance", "epic quest"]
+
+DEFAULT_MIX = "publishers=8,recommend=4,extract-names=2,summarize=1"
+
+
+def make_request(route, n, cacheable):
+    """(method, path, json body) for the n-th request to route."""
+    if route == "publishers":
+        return "GET", "/publishers", None
+    if route == "recommend":
+        return "POST", "/recommend", {"keywords": KEYWORDS[n % len(KEYWORDS)]}
+    if route == "extract-names":
+        return "POST", "/extract-names", {"text": NER_TEXT}
+    if route == "summarize":
+        text = SUMMARY_TEXT if cacheable else f"Request {n}. {SUMMARY_TEXT}"
+        return "POST", "/summarize", {"text": text}
+    raise ValueError(f"unknown route {route!r}")
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return 0.0
+    k = max(0, min(len(sorted_values) - 1, math.ceil(q / 100.0 * len(sorted_values)) - 1))
+    return sorted_values[k]
+
+
+class Results:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = {}   # route -> [seconds], successful requests only
+        self.statuses = {}    # route -> Counter(status)
+
+    def record(self, route, status, seconds):
+        with self.lock:
+            self.statuses.setdefault(route, Counter())[status] += 1
+            if status == 200:
+                self.latencies.setdefault(route, []).append(seconds)
+
+
+def client(url, routes, weights, deadline, results, counter, cacheable, timeout):
+    parsed = urlparse(url)
+    conn = None
+    rng = random.Random()
+    while time.time() < deadline:
+        route = rng.choices(routes, weights)[0]
+        method, path, body = make_request(route, next(counter), cacheable)
+        payload = json.dumps(body).encode("utf-8") if body is not None else None
+        headers = {"Content-Type": "application/json"} if body is not None else {}
+        t0 = time.perf_counter()
+        try:
+            if conn is None:
+                conn = http.client.HTTPConnection(parsed.hostname, parsed.port or 80, timeout=timeout)
+            conn.request(method, path, body=payload, headers=headers)
+            resp = conn.getresponse()
+            resp.read()
+            status = resp.status
+        except (OSError, http.client.HTTPException):
+            status = "error"
+            if conn is not None:
+                conn.close()
+            conn = None
+        results.record(route, status, time.perf_counter() - t0)
+    if conn is not None:
+        conn.close()
+
+
+def report(results, elapsed):
+    print(f"\n{'route':>14} {'ok':>7} {'429':>5} {'503':>5} {'504':>5} {'other':>6} {'req/s':>8} "
+          f"{'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max ms':>8}")
+    all_latencies = []
+    totals = Counter()
+    for route in sorted(results.statuses):
+        statuses = results.statuses[route]
+        lat = sorted(results.latencies.get(route, []))
+        all_latencies.extend(lat)
+        totals.update(statuses)
+        _print_row(route, statuses, lat, elapsed)
+    _print_row("all", totals, sorted(all_latencies), elapsed)
+
+
+def _print_row(name, statuses, lat, elapsed):
+    ok = statuses.get(200, 0)
+    rejected = [statuses.get(code, 0) for code in (429, 503, 504)]
+    other = sum(statuses.values()) - ok - sum(rejected)
+    ms = [x * 1000.0 for x in (percentile(lat, 50), percentile(lat, 95), percentile(lat, 99), lat[-1] if lat else 0.0)]
+    print(f"{name:>14} {ok:>7} {rejected[0]:>5} {rejected[1]:>5} {rejected[2]:>5} {other:>6} {ok / elapsed:>8.1f} "
+          f"{ms[0]:>8.1f} {ms[1]:>8.1f} {ms[2]:>8.1f} {ms[3]:>8.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test: requests/sec and tail latency per route.")
+    parser.add_argument("--url", default="http://localhost:5000")
+    parser.add_argument("--duration", type=float, default=30.0, help="Seconds to run.")
+    parser.add_argument("--clients", type=int, default=16, help="Concurrent client threads.")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="route=weight,... (publishers, recommend, extract-names, summarize)")
+    parser.add_argument("--cacheable", action="store_true", help="Send the same /summarize text every time.")
+    parser.add_argument("--timeout", type=float, default=120.0, help="Per-request timeout in seconds.")
+    args = parser.parse_args()
+
+    mix = [part.split("=") for part in args.mix.split(",") if part]
+    routes = [name.strip() for name, _ in mix]
+    weights = [float(w) for _, w in mix]
+    for route in routes:
+        make_request(route, 0, True)   # fail early on a typo
+
+    results = Results()
+    counter = itertools.count()
+    print(f"{args.clients} clients for {args.duration:.0f}s against {args.url} (mix: {args.mix})")
+    t0 = time.time()
+    deadline = t0 + args.duration
+    threads = [
+        threading.Thread(target=client, daemon=True,
+                         args=(args.url, routes, weights, deadline, results, counter, args.cacheable, args.timeout))
+        for _ in range(args.clients)
+    ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    report(results, time.time() - t0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,291 @@
+# profiling.py
+# Low-overhead profiling for the API.
+#
+#  - Stage timers: a sampled fraction of requests (PROFILE_SAMPLE_RATE) records
+#    how long each stage took (tokenize / generate / decode, every Stanza
+#    processor, TF-IDF transform / similarity / sort, queue waits, ...).
+#    For the other requests a stage is one ContextVar lookup, so this can stay
+#    on in production. Every request's total time is recorded regardless.
+#    Stages are aggregated into per-endpoint latency histograms.
+#  - Stack sampler (opt-in): a thread that snapshots every thread's Python
+#    stack every PROFILE_STACK_INTERVAL_MS and counts them in the folded
+#    format flame graph tools read ("thread;file:func;file:func count").
+#    Inference processes (execution.py) sample themselves and send their
+#    stacks back with each result.
+# app.py serves both at /debug/profile.
+
+import bisect
+import functools
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+# --------- Configurable defaults ----------
+SAMPLE_RATE = float(os.environ.get("PROFILE_SAMPLE_RATE", 0.01))   # fraction of requests with stage timers
+STACKS = os.environ.get("PROFILE_STACKS") == "1"                   # start the stack sampler right away
+STACK_INTERVAL_MS = float(os.environ.get("PROFILE_STACK_INTERVAL_MS", 10))
+BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 30000, 60000)
+# ------------------------------------------
+
+# leaf frames in these files are threads parked in a wait, not doing work
+IDLE_FILES = {"threading.py", "selectors.py", "queue.py", "socket.py", "socketserver.py", "connection.py", "thread.py"}
+IGNORED_THREADS = {"stack-sampler", "parent-watch"}
+
+_current = ContextVar("request_profile", default=None)
+_BUCKET_LABELS = [f"<={b}" for b in BUCKETS_MS] + [f">{BUCKETS_MS[-1]}"]
+
+
+class RequestProfile:
+    """Stage timings of one sampled request: [(stage, seconds)]."""
+    __slots__ = ("stages",)
+
+    def __init__(self):
+        self.stages = []
+
+
+def current():
+    return _current.get()
+
+
+@contextmanager
+def stage(name):
+    prof = _current.get()
+    if prof is None:
+        yield
+        return
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        prof.stages.append((name, time.perf_counter() - t0))
+
+
+def timed(name, fn):
+    """fn wrapped so that each call is recorded as stage `name`."""
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        prof = _current.get()
+        if prof is None:
+            return fn(*args, **kwargs)
+        t0 = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            prof.stages.append((name, time.perf_counter() - t0))
+    return wrapper
+
+
+@contextmanager
+def collect(prof):
+    """Record stages into prof (e.g. a batch run on behalf of other requests)."""
+    token = _current.set(prof)
+    try:
+        yield prof
+    finally:
+        _current.reset(token)
+
+
+# ---------------------------
+# Model instrumentation
+# ---------------------------
+def instrument_pipeline(pipe, prefix="summarizer"):
+    """Time a transformers pipeline's preprocess (tokenize), _forward (generate) and postprocess (decode)."""
+    for attr, name in (("preprocess", "tokenize"), ("_forward", "generate"), ("postprocess", "decode")):
+        setattr(pipe, attr, timed(f"{prefix}.{name}", getattr(pipe, attr)))
+    return pipe
+
+
+def instrument_stanza(nlp, prefix="stanza"):
+    """Time every processor of a Stanza pipeline (bulk_process, which the NER engine uses)."""
+    for name, processor in nlp.processors.items():
+        processor.bulk_process = timed(f"{prefix}.{name}", processor.bulk_process)
+    return nlp
+
+
+# ---------------------------
+# Aggregation
+# ---------------------------
+class Histogram:
+    __slots__ = ("counts", "count", "total", "max")
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS_MS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds):
+        ms = seconds * 1000.0
+        self.counts[bisect.bisect_left(BUCKETS_MS, ms)] += 1
+        self.count += 1
+        self.total += ms
+        self.max = max(self.max, ms)
+
+    def percentile(self, q):
+        """Upper bound (ms) of the bucket holding the q-th percentile."""
+        target = q / 100.0 * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if n and seen >= target:
+                return BUCKETS_MS[i] if i < len(BUCKETS_MS) else self.max
+        return self.max
+
+    def to_dict(self):
+        return {
+            "count": self.count,
+            "mean_ms": round(self.total / self.count, 3) if self.count else 0.0,
+            "p50_ms": self.percentile(50), "p95_ms": self.percentile(95), "p99_ms": self.percentile(99),
+            "max_ms": round(self.max, 3),
+            "buckets_ms": {label: n for label, n in zip(_BUCKET_LABELS, self.counts) if n},
+        }
+
+
+def _fold(frame):
+    names = []
+    while frame is not None and len(names) < 64:
+        code = frame.f_code
+        names.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+class StackSampler:
+    def __init__(self, interval_ms=STACK_INTERVAL_MS):
+        self.interval = max(1.0, float(interval_ms)) / 1000.0
+        self.enabled = False
+        self.samples = 0
+        self.counts = Counter()
+        self._reset()
+        os.register_at_fork(after_in_child=self._reset)
+
+    def _reset(self):
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def start(self):
+        self.enabled = True
+        self.ensure()
+
+    def stop(self):
+        self.enabled = False
+
+    def ensure(self):
+        if self.enabled and (self._thread is None or not self._thread.is_alive()):
+            self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while self.enabled:
+            names = {t.ident: t.name for t in threading.enumerate()}
+            frames = sys._current_frames()
+            with self._lock:
+                for ident, frame in frames.items():
+                    name = names.get(ident, "?")
+                    if name in IGNORED_THREADS or os.path.basename(frame.f_code.co_filename) in IDLE_FILES:
+                        continue
+                    self.counts[f"{name.split('-')[0]};{_fold(frame)}"] += 1
+                self.samples += 1
+            time.sleep(self.interval)
+
+    def drain(self):
+        with self._lock:
+            counts, self.counts = self.counts, Counter()
+        return counts
+
+    def merge(self, counts):
+        if counts:
+            with self._lock:
+                self.counts.update(counts)
+
+    def folded(self):
+        with self._lock:
+            return "\n".join(f"{stack} {n}" for stack, n in self.counts.most_common())
+
+
+class Profiler:
+    def __init__(self, sample_rate=SAMPLE_RATE, stacks=STACKS, interval_ms=STACK_INTERVAL_MS):
+        self.sample_rate = sample_rate
+        self.sampler = StackSampler(interval_ms)
+        self.sampler.enabled = stacks   # started lazily, in the process that serves requests
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.histograms = {}   # endpoint -> {stage: Histogram}
+            self.requests = Counter()
+            self.sampled = Counter()
+        self.sampler.drain()
+
+    def begin(self, endpoint):
+        self.sampler.ensure()
+        prof = RequestProfile() if self.sample_rate > 0 and random.random() < self.sample_rate else None
+        _current.set(prof)
+        return endpoint, time.perf_counter(), prof
+
+    def end(self, handle):
+        endpoint, t0, prof = handle
+        total = time.perf_counter() - t0
+        _current.set(None)
+        with self._lock:
+            stages = self.histograms.setdefault(endpoint, {})
+            stages.setdefault("total", Histogram()).add(total)
+            self.requests[endpoint] += 1
+            if prof is not None:
+                self.sampled[endpoint] += 1
+                for name, seconds in prof.stages:
+                    stages.setdefault(name, Histogram()).add(seconds)
+
+    def snapshot(self, top=20):
+        with self._lock:
+            endpoints = {
+                endpoint: {
+                    "requests": self.requests[endpoint],
+                    "sampled": self.sampled[endpoint],
+                    "stages": {name: h.to_dict() for name, h in sorted(stages.items())},
+                }
+                for endpoint, stages in self.histograms.items()
+            }
+        with self.sampler._lock:
+            top_stacks = self.sampler.counts.most_common(top)
+        return {
+            "pid": os.getpid(),
+            "sample_rate": self.sample_rate,
+            "stacks": {"enabled": self.sampler.enabled, "samples": self.sampler.samples,
+                       "top": [{"stack": s, "count": n} for s, n in top_stacks]},
+            "endpoints": endpoints,
+        }
+
+
+profiler = Profiler()
+
+
+# ---------------------------
+# Inference processes (execution.py)
+# ---------------------------
+def run_captured(fn, args, kwargs, sampled, stacks):
+    """
+    Run fn in an inference process; returns (result, stages or None, stack
+    counts or None) so the serving process can merge them into its profile.
+    """
+    if stacks:
+        profiler.sampler.start()
+    else:
+        profiler.sampler.stop()
+    prof = RequestProfile() if sampled else None
+    with collect(prof):
+        result = fn(*args, **kwargs)
+    return result, prof.stages if prof else None, profiler.sampler.drain() if stacks else None
+
+
+def merge_captured(stages, stacks):
+    prof = _current.get()
+    if prof is not None and stages:
+        prof.stages.extend(stages)
+    profiler.sampler.merge(stacks)
@@ -0,0 +1,264 @@
+"""
+publisher_health.py
+Per-publisher health for the scraper: adaptive timeouts and a circuit breaker.
+
+Every scrape of a publisher is recorded. Successful runs feed a rolling
+window of page-load latencies (navigation + wait_for), and the page-load
+timeout of the next run is derived from their p95 (times TIMEOUT_FACTOR, at
+least MIN_TIMEOUT_MS, doubled per consecutive failure, at most the
+publisher's configured timeout_ms) instead of always waiting the full 90 s. After FAILURE_THRESHOLD consecutive failures
+the publisher's circuit opens: runs skip it for a cool-down period and serve
+its last good result instead. When the cool-down ends one trial run is let
+through (half-open), with min(timeout_ms, TRIAL_TIMEOUT_MS) to load; concurrent runs
+keep serving the cached result meanwhile. Success closes the circuit;
+failure reopens it with a doubled cool-down.
+State, including each publisher's last good books, is kept in
+publisher_health.json so it survives restarts; updates hold an flock on
+publisher_health.json.lock, so processes don't overwrite each other's.
+
+Usage:
+    python publisher_health.py status
+    python publisher_health.py reset "DAW Books"
+"""
+
+import argparse
+import contextlib
+import json
+import math
+import os
+import threading
+import time
+from pathlib import Path
+
+try:
+    import fcntl
+except ImportError:  # Windows: single process only (no gunicorn there)
+    fcntl = None
+
+# --------- Configurable defaults ----------
+HEALTH_PATH = Path(os.environ.get("PUBLISHER_HEALTH_PATH", "publisher_health.json"))
+WINDOW = 20                  # latencies kept per publisher
+MIN_SAMPLES = 3              # below this, the configured timeout is used
+TIMEOUT_FACTOR = 2.0         # timeout = p95 * factor (doubled per consecutive failure)
+MIN_TIMEOUT_MS = 10000
+FAILURE_THRESHOLD = 3        # consecutive failures that open the circuit
+TRIAL_TIMEOUT_MS = 20000     # page-load budget of a half-open trial
+TRIAL_CLAIM_S = 120          # a claimed trial that never reports back expires after this
+COOLDOWN_S = float(os.environ.get("PUBLISHER_COOLDOWN_S", 30 * 60))
+MAX_COOLDOWN_S = 6 * 60 * 60
+# ------------------------------------------
+
+
+def _percentile(values, q):
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(q / 100.0 * len(ordered)) - 1)]
+
+
+class PublisherHealth:
+    def __init__(self, path=HEALTH_PATH):
+        self.path = Path(path)
+        self._lock = threading.Lock()
+        self._stamp = None
+        # name -> {"latencies_ms", "failures", "open_until", "trial_until", "cooldown_s", "last_error", "last_good"}
+        self.state = {}
+
+    # ---------------------------
+    # Persistence
+    # ---------------------------
+    def _refresh(self):
+        # another process (gunicorn worker) may have written since we last looked
+        try:
+            st = self.path.stat()
+        except OSError:
+            return
+        stamp = (st.st_mtime_ns, st.st_ino)   # every save is a new file (os.replace)
+        if stamp == self._stamp:
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                self.state = json.load(f)
+            self._stamp = stamp
+        except (OSError, ValueError) as e:
+            print(f"[Health] could not read {self.path}: {e}")
+
+    @contextlib.contextmanager
+    def _locked(self):
+        """
+        For refresh -> mutate -> save: holds the thread lock and an flock on
+        publisher_health.json.lock, so another process (gunicorn worker, the
+        CLI) can't save in between and have its change overwritten.
+        """
+        with self._lock:
+            if fcntl is None:
+                yield
+                return
+            try:
+                f = open(self.path.with_name(self.path.name + ".lock"), "a")
+            except OSError as e:
+                print(f"[Health] could not open the lock file: {e}")
+                yield
+                return
+            with f:
+                fcntl.flock(f, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _save(self):
+        tmp = self.path.with_name(self.path.name + f".{os.getpid()}.tmp")
+        try:
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(self.state, f, ensure_ascii=False, indent=2)
+            os.replace(tmp, self.path)
+            st = self.path.stat()
+            self._stamp = (st.st_mtime_ns, st.st_ino)
+        except OSError as e:
+            print(f"[Health] could not write {self.path}: {e}")
+
+    def _entry(self, name):
+        return self.state.setdefault(name, {
+            "latencies_ms": [], "failures": 0, "open_until": 0.0, "trial_until": 0.0, "cooldown_s": COOLDOWN_S,
+            "last_error": "", "last_good": None,
+        })
+
+    # ---------------------------
+    # Decisions
+    # ---------------------------
+    def allow(self, name, now=None):
+        """
+        True when the circuit is closed. Once the cool-down has passed, True
+        for exactly one caller, which claims the half-open trial (also for
+        other processes, through the state file); False otherwise.
+        """
+        now = now or time.time()
+        with self._locked():
+            self._refresh()
+            entry = self.state.get(name)
+            if entry is None or not entry["open_until"]:
+                return True
+            if now < entry["open_until"] or now < entry.get("trial_until", 0.0):
+                return False
+            entry["trial_until"] = now + TRIAL_CLAIM_S
+            self._save()
+            return True
+
+    def timeout_ms(self, name, configured_ms):
+        """
+        Page-load budget for the next run: p95 of recent successful loads *
+        factor, at least MIN_TIMEOUT_MS, then doubled per consecutive failure
+        (so a site that got slower is given room to recover), capped at
+        configured_ms. A half-open trial gets min(configured_ms, TRIAL_TIMEOUT_MS),
+        whatever the history says.
+        """
+        with self._lock:
+            self._refresh()
+            entry = self.state.get(name)
+            if entry is None:
+                return configured_ms
+            if entry["open_until"]:
+                return min(configured_ms, TRIAL_TIMEOUT_MS)
+            if len(entry["latencies_ms"]) < MIN_SAMPLES:
+                return configured_ms
+            budget = max(MIN_TIMEOUT_MS, _percentile(entry["latencies_ms"], 95) * TIMEOUT_FACTOR)
+            return int(min(configured_ms, budget * 2 ** entry["failures"]))
+
+    def last_good(self, name):
+        """(books, unix time) of the last non-empty result, or ([], None)."""
+        with self._lock:
+            self._refresh()
+            good = (self.state.get(name) or {}).get("last_good")
+            return (list(good["books"]), good["at"]) if good else ([], None)
+
+    # ---------------------------
+    # Recording
+    # ---------------------------
+    def record_success(self, name, load_seconds, books):
+        """load_seconds: page load only (navigation + wait_for), what timeout_ms() budgets."""
+        with self._locked():
+            self._refresh()
+            entry = self._entry(name)
+            entry["latencies_ms"] = (entry["latencies_ms"] + [round(load_seconds * 1000.0)])[-WINDOW:]
+            entry["failures"] = 0
+            entry["open_until"] = 0.0
+            entry["trial_until"] = 0.0
+            entry["cooldown_s"] = COOLDOWN_S
+            entry["last_error"] = ""
+            if books:
+                # local files from this run's image download are not part of the cached result
+                keep = [{k: v for k, v in b.items() if k not in ("local_image", "cid")} for b in books]
+                entry["last_good"] = {"at": time.time(), "books": keep}
+            self._save()
+
+    def record_failure(self, name, error):
+        with self._locked():
+            self._refresh()
+            entry = self._entry(name)
+            entry["failures"] += 1
+            entry["last_error"] = str(error)[:300]
+            entry["trial_until"] = 0.0
+            if entry["open_until"]:
+                # a half-open trial failed: back off further
+                entry["cooldown_s"] = min(MAX_COOLDOWN_S, entry["cooldown_s"] * 2)
+            if entry["failures"] >= FAILURE_THRESHOLD:
+                entry["open_until"] = time.time() + entry["cooldown_s"]
+                print(f"[Health] {name}: circuit open for {entry['cooldown_s'] / 60:.0f} min "
+                      f"after {entry['failures']} failures ({entry['last_error']})")
+            self._save()
+
+    def reset(self, name=None):
+        with self._locked():
+            self._refresh()
+            if name is None:
+                self.state = {}
+            else:
+                self.state.pop(name, None)
+            self._save()
+
+    def status(self, now=None):
+        now = now or time.time()
+        with self._lock:
+            self._refresh()
+            rows = []
+            for name, entry in sorted(self.state.items()):
+                lat = entry["latencies_ms"]
+                if entry["open_until"] > now:
+                    circuit = f"open ({(entry['open_until'] - now) / 60:.0f} min left)"
+                elif entry.get("trial_until", 0.0) > now:
+                    circuit = "half-open (trial running)"
+                elif entry["open_until"]:
+                    circuit = "half-open"
+                else:
+                    circuit = "closed"
+                rows.append({
+                    "publisher": name, "circuit": circuit, "failures": entry["failures"],
+                    "p50_ms": _percentile(lat, 50) if lat else None, "p95_ms": _percentile(lat, 95) if lat else None,
+                    "cached_books": len(entry["last_good"]["books"]) if entry.get("last_good") else 0,
+                    "last_error": entry["last_error"],
+                })
+            return rows
+
+
+health = PublisherHealth()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Publisher health (adaptive timeouts / circuit breaker).")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    sub.add_parser("status")
+    r = sub.add_parser("reset")
+    r.add_argument("publisher", nargs="?", help="Publisher to reset (default: all).")
+    args = parser.parse_args()
+
+    if args.cmd == "reset":
+        health.reset(args.publisher)
+        print("Reset", args.publisher or "all publishers")
+        return
+    print(f"{'publisher':>20} {'circuit':>26} {'fails':>5} {'p50 ms':>8} {'p95 ms':>8} {'cached':>6}  last error")
+    for row in health.status():
+        print(f"{row['publisher']:>20} {row['circuit']:>26} {row['failures']:>5} {row['p50_ms'] or '-':>8} "
+              f"{row['p95_ms'] or '-':>8} {row['cached_books']:>6}  {row['last_error']}")
+
+
+if __name__ == "__main__":
+    main()
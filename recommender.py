@@ -0,0 +1,214 @@
+# recommender.py
+# TF-IDF book recommender that can grow at runtime.
+#
+# The base catalog (Books.csv) is vectorized once. Books scraped later by
+# books_scraper_full.run_for are appended to a small "delta" segment using the
+# same fixed feature space (HashingVectorizer) and the IDF weights learned from
+# the base catalog, so nothing has to be refit. The delta is folded into the
+# base matrix by a background thread once it grows past DELTA_MERGE_ROWS.
+
+import json
+import threading
+from pathlib import Path
+
+import numpy as np
+import scipy.sparse as sp
+from sklearn.feature_extraction.text import HashingVectorizer, TfidfTransformer
+
+from profiling import stage
+
+# ---------------------------
+# Settings
+# ---------------------------
+N_FEATURES = 2 ** 20          # hashed vocabulary size (fixed, never refit)
+DELTA_MERGE_ROWS = 500        # merge delta segment into base after this many rows
+SCRAPED_BOOKS_PATH = Path("scraped_books.jsonl")
+
+
+def book_text(title, author, publisher, extra=""):
+    """Text used for vectorizing one book (same fields for CSV and scraped rows)."""
+    parts = [title or "", author or "", publisher or "", extra or ""]
+    return " ".join(p for p in parts if p)
+
+
+class BookIndex:
+    """
+    Cosine-similarity index over a base catalog (catalog.Catalog) plus an
+    appendable delta segment. Rows are L2-normalized, so similarity is a
+    sparse dot product.
+    """
+
+    def __init__(self, catalog):
+        self.vectorizer = HashingVectorizer(
+            n_features=N_FEATURES, stop_words="english", alternate_sign=False, norm=None,
+            dtype=np.float32,
+        )
+        self.idf = TfidfTransformer()
+
+        # descriptions are generated on the fly and never stored
+        counts = self.vectorizer.transform(book_text(t, a, p) for t, a, p in catalog.iter_fields())
+        self.idf.fit(counts)
+
+        self._lock = threading.Lock()
+        # serializes add_books (dedupe, row ids, the JSONL append, listeners) without
+        # blocking searches, which only take _lock for a segment snapshot
+        self._add_lock = threading.Lock()
+        self._merging = False
+        self._catalog = catalog
+        self._base = self.idf.transform(counts).tocsr()
+        self._extra = []                 # metadata for rows appended after startup
+        self._extra_keys = set()
+        # how far scraped_books.jsonl has been read; other gunicorn workers append to it
+        self._scraped_lock = threading.Lock()
+        self._scraped_offset = 0
+        self._delta = sp.csr_matrix((0, N_FEATURES), dtype=self._base.dtype)
+        # callbacks fn(first_row_id, rows) run after rows are appended
+        # (e.g. the dense embedding index keeps its row ids in sync this way)
+        self.listeners = []
+
+    @property
+    def shape(self):
+        base, delta = self._segments()
+        return (base.shape[0] + delta.shape[0], N_FEATURES)
+
+    def _segments(self):
+        with self._lock:
+            return self._base, self._delta
+
+    def vectorize(self, texts):
+        return self.idf.transform(self.vectorizer.transform(texts))
+
+    # ---------------------------
+    # Incremental updates
+    # ---------------------------
+    def add_books(self, books, persist=True):
+        """
+        Append scraped book dicts (title/author/publisher/...) to the index.
+        Books already added (same title + publisher) are skipped.
+        Returns the number of rows actually added.
+        """
+        with self._add_lock:
+            new_rows = []
+            for b in books:
+                title = (b.get("title") or "").strip()
+                if not title or title == "No Title":
+                    continue
+                key = (title.lower(), (b.get("publisher") or "").strip().lower())
+                if key in self._extra_keys:
+                    continue
+                self._extra_keys.add(key)
+                new_rows.append({
+                    "title": title,
+                    "author": (b.get("author") or "").strip(),
+                    "publisher": (b.get("publisher") or "").strip(),
+                    "link": b.get("link", ""),
+                    "excerpt": (b.get("excerpt") or "").strip(),
+                })
+            if not new_rows:
+                return 0
+
+            vecs = self.vectorize([
+                book_text(r["title"], r["author"], r["publisher"], r["excerpt"]) for r in new_rows
+            ])
+            with self._lock:
+                first_id = len(self._catalog) + len(self._extra)
+                self._extra.extend(new_rows)
+                self._delta = sp.vstack([self._delta, vecs], format="csr")
+                start_merge = self._delta.shape[0] >= DELTA_MERGE_ROWS and not self._merging
+                if start_merge:
+                    self._merging = True
+
+            if persist:
+                # one write, so appends from several workers don't interleave mid-line
+                with open(SCRAPED_BOOKS_PATH, "a", encoding="utf-8") as f:
+                    f.write("".join(json.dumps(r, ensure_ascii=False) + "\n" for r in new_rows))
+
+            if start_merge:
+                threading.Thread(target=self._merge_delta, daemon=True).start()
+            for fn in self.listeners:
+                try:
+                    fn(first_id, new_rows)
+                except Exception as e:
+                    print("[Recommender] listener error:", e)
+            print(f"[Recommender] added {len(new_rows)} books (total rows: {self.shape[0]})")
+            return len(new_rows)
+
+    def _merge_delta(self):
+        try:
+            base, delta = self._segments()
+            n = delta.shape[0]
+            merged = sp.vstack([base, delta], format="csr")
+            with self._lock:
+                # rows appended while we were stacking stay in the delta
+                self._base = merged
+                self._delta = self._delta[n:]
+        finally:
+            self._merging = False
+
+    def load_scraped(self, path=SCRAPED_BOOKS_PATH):
+        """
+        Add books appended to scraped_books.jsonl since the last call (all of
+        them on the first call): books scraped in earlier runs, or by another
+        gunicorn worker. Cheap when the file has not grown (one stat), so it
+        is called on every /recommend. Our own appends are read back too and
+        skipped by the title + publisher dedupe.
+        """
+        path = Path(path)
+        try:
+            size = path.stat().st_size
+        except OSError:
+            return 0
+        if size == self._scraped_offset or not self._scraped_lock.acquire(blocking=False):
+            return 0   # unchanged, or another thread is already reading it
+        try:
+            if size < self._scraped_offset:
+                self._scraped_offset = 0   # truncated or replaced: read it again
+            with open(path, "rb") as f:
+                f.seek(self._scraped_offset)
+                data = f.read()
+            # a line still being written by another worker is read next time
+            end = data.rfind(b"\n") + 1
+            self._scraped_offset += end
+            books = []
+            for line in data[:end].decode("utf-8", errors="replace").splitlines():
+                line = line.strip()
+                if line:
+                    try:
+                        books.append(json.loads(line))
+                    except ValueError:
+                        continue
+        finally:
+            self._scraped_lock.release()
+        return self.add_books(books, persist=False) if books else 0
+
+    # ---------------------------
+    # Queries
+    # ---------------------------
+    def row(self, idx):
+        n_base = len(self._catalog)
+        if idx < n_base:
+            return self._catalog.row(idx)
+        r = self._extra[idx - n_base]
+        return {"title": r["title"], "author": r["author"], "publisher": r["publisher"]}
+
+    def search(self, keywords, top_n=3):
+        base, delta = self._segments()
+        with stage("tfidf.transform"):
+            user_vec = self.vectorize([keywords])
+        with stage("tfidf.similarity"):
+            sims = (base @ user_vec.T).toarray().ravel()
+            if delta.shape[0]:
+                sims = np.concatenate([sims, (delta @ user_vec.T).toarray().ravel()])
+        with stage("tfidf.sort"):
+            top_n = min(top_n, sims.shape[0])
+            top = np.argpartition(sims, -top_n)[-top_n:]
+            top = top[np.argsort(sims[top])[::-1]]
+        return [(int(i), float(sims[i])) for i in top]
+
+    def recommend(self, keywords, top_n=3):
+        results = []
+        for idx, score in self.search(keywords, top_n):
+            book = self.row(idx)
+            book["score"] = score
+            results.append(book)
+        return results
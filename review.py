@@ -6,24 +6,43 @@ Usage:
     python local_summarizer.py --input-file chapter_fa.txt --lang fa
 it has a little limit that i sure can handle if i have time
 You can also run without --input-file and paste text into stdin (end with EOF).
+
+Whole books (batch mode): chapters are summarized in parallel worker
+processes, each with its own model, then the chapter summaries are reduced
+into a whole-book summary. Re-running skips chapters that are already done.
+    python local_summarizer.py --book book.txt --out-dir summaries/       # split on "Chapter ..." headings
+    python local_summarizer.py --book chapters/ --out-dir summaries/ --workers 4   # one file per chapter
 """
 
 import argparse
-from transformers import pipeline, AutoTokenizer, AutoModelForSeq2SeqLM
-import math
+import hashlib
+import json
+import multiprocessing
 import os
+import re
 import sys
-from typing import List
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from summarization import create_summarizer, summarize_long, CHUNK_TOKENS, BACKENDS
+from summary_server import SummaryServer
+from summary_cache import SummaryCache
 
 # --------- Configurable defaults ----------
 DEFAULT_EN_MODEL = "facebook/bart-large-cnn"   # good general English summarizer
 DEFAULT_MULTI_MODEL = "google/mt5-small"       # multilingual (smaller) — supports many langs incl. fa
 # You can replace DEFAULT_MULTI_MODEL with a Persian-finetuned model if you have one.
 
-# size limits (characters) for chunking — tune based on model token limits and GPU/RAM
-CHUNK_CHAR_SIZE = 2500    # approx characters per chunk (safe default)
-SUMMARY_MAX_LENGTH = 130  # max tokens for per-chunk summary (model tokens; approximate)
+# chunking is done by model tokens (see summarization.py); chunk summaries are batched
+SUMMARY_MAX_LENGTH = 130  # max tokens for per-chunk summary
 SUMMARY_MIN_LENGTH = 30
+BATCH_SIZE = 8            # chunks summarized together in one forward pass
+
+# batch mode
+# "Chapter 3", "CHAPTER IV: The Road", "فصل ۳"; short lines not ending like a sentence
+CHAPTER_HEADING = r"^[ \t]*(?:chapter|chap\.|\u0641\u0635\u0644)\s+[^\n]{0,59}[^\s.!?,;\u060C\u061F][ \t]*$"
+THREADS_PER_WORKER = 4    # default worker count is cores / this
+MANIFEST = "manifest.json"
 
 # ------------------------------------------
 
@@ -35,62 +54,173 @@ def read_input(input_file: str):
         print("Paste the chapter text, then press Ctrl+D (or Ctrl+Z+Enter on Windows):")
         return sys.stdin.read()
 
-def chunk_text(text: str, max_chunk_chars: int) -> List[str]:
-    """Split text into chunks of ~max_chunk_chars without cutting sentences badly."""
-    import re
-    sentences = re.split(r'(?<=[.!؟!\n])\s+', text)  # split on sentence boundaries (includes Persian punctuation)
-    chunks = []
-    current = ""
-    for s in sentences:
-        if len(current) + len(s) <= max_chunk_chars or not current:
-            current += ("" if current == "" else " ") + s
+def print_progress(event):
+    if event["event"] == "level":
+        if event["chunks"] > 1:
+            sys.stdout.write(f"Level {event['level']}: summarizing {event['chunks']} chunks...\n")
         else:
-            chunks.append(current.strip())
-            current = s
-    if current.strip():
-        chunks.append(current.strip())
-    return chunks
+            sys.stdout.write("Summarizing into final summary...\n")
+    elif event["event"] == "chunk":
+        sys.stdout.write(f"  chunk {event['index'] + 1}/{event['total']} done\n")
+    sys.stdout.flush()
 
-def create_summarizer(model_name: str, device: int = -1):
+def summarize_long_text(text: str, summarizer, lang: str = "en", chunk_tokens: int = CHUNK_TOKENS, cache=None) -> str:
     """
-    Create a transformers summarization pipeline.
-    device=-1 -> CPU, device=0 -> first GPU.
+    Hierarchical summarization (see summarization.iter_summarize_long):
+    token-based chunks, all chunks of a level batched through the model,
+    reduced recursively until one summary remains.
+    Chunks already in the summary cache are not summarized again.
     """
-    # load model and tokenizer explicitly for better control
-    tokenizer = AutoTokenizer.from_pretrained(model_name)
-    model = AutoModelForSeq2SeqLM.from_pretrained(model_name)
-    summarizer = pipeline("summarization", model=model, tokenizer=tokenizer, device=device)
-    return summarizer
+    server = SummaryServer(summarizer, max_batch_size=BATCH_SIZE, max_wait_ms=0, cache=cache)
+    return summarize_long(
+        text, server, summarizer.tokenizer, chunk_tokens, progress=print_progress,
+        max_length=SUMMARY_MAX_LENGTH, min_length=SUMMARY_MIN_LENGTH, do_sample=False,
+    )
+
+# ---------------------------
+# Batch mode: whole books
+# ---------------------------
+def _natural_key(name):
+    return [int(part) if part.isdigit() else part.lower() for part in re.split(r"(\d+)", name)]
+
+def split_chapters(text: str, pattern: str = CHAPTER_HEADING):
+    """[(title, text)] split on heading lines; text before the first heading becomes "Front matter"."""
+    heads = list(re.finditer(pattern, text, re.IGNORECASE | re.MULTILINE))
+    if not heads:
+        return [("Chapter 1", text.strip())] if text.strip() else []
+    chapters = []
+    front = text[:heads[0].start()].strip()
+    if front:
+        chapters.append(("Front matter", front))
+    for i, m in enumerate(heads):
+        end = heads[i + 1].start() if i + 1 < len(heads) else len(text)
+        body = text[m.end():end].strip()
+        if body:
+            chapters.append((m.group().strip(), body))
+    return chapters
+
+def read_chapters(path: str, pattern: str = CHAPTER_HEADING):
+    """A directory is one chapter per .txt file (natural order); a file is split on headings."""
+    if os.path.isdir(path):
+        chapters = []
+        for name in sorted(os.listdir(path), key=_natural_key):
+            if name.lower().endswith(".txt"):
+                with open(os.path.join(path, name), "r", encoding="utf-8") as f:
+                    text = f.read().strip()
+                if text:
+                    chapters.append((os.path.splitext(name)[0], text))
+        return chapters
+    with open(path, "r", encoding="utf-8") as f:
+        return split_chapters(f.read(), pattern)
+
+def _sha256(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+def _write_atomic(path: str, text: str):
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(tmp, path)   # a killed run never leaves a half-written summary
 
-def summarize_long_text(text: str, summarizer, lang: str = "en") -> str:
+def load_manifest(out_dir: str) -> dict:
+    try:
+        with open(os.path.join(out_dir, MANIFEST), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {"chapters": {}}
+
+def save_manifest(out_dir: str, manifest: dict):
+    _write_atomic(os.path.join(out_dir, MANIFEST), json.dumps(manifest, ensure_ascii=False, indent=2))
+
+_worker_summarizer = None
+_worker_cache = None
+
+def _init_worker(model_name, device, backend, threads, use_cache):
+    global _worker_summarizer, _worker_cache
+    _worker_summarizer = create_summarizer(model_name, device=device, backend=backend, threads=threads)
+    _worker_cache = SummaryCache() if use_cache else None
+
+def _summarize_in_worker(text: str, out_path: str, chunk_tokens: int):
+    t0 = time.perf_counter()
+    server = SummaryServer(_worker_summarizer, max_batch_size=BATCH_SIZE, max_wait_ms=0, cache=_worker_cache)
+    summary = summarize_long(
+        text, server, _worker_summarizer.tokenizer, chunk_tokens,
+        max_length=SUMMARY_MAX_LENGTH, min_length=SUMMARY_MIN_LENGTH, do_sample=False,
+    ).strip()
+    _write_atomic(out_path, summary + "\n")
+    return summary, time.perf_counter() - t0
+
+def summarize_book(book_path: str, out_dir: str, model_name: str, device: int = -1, backend: str = "torch",
+                   workers: int = None, threads: int = None, chunk_tokens: int = CHUNK_TOKENS,
+                   use_cache: bool = True, pattern: str = CHAPTER_HEADING):
     """
-    Hierarchical summarization:
-      1) split into chunks
-      2) summarize each chunk
-      3) if >1 chunk, join summaries and summarize again
+    Summarize every chapter in worker processes, then the chapters' summaries
+    into out_dir/book_summary.txt. A chapter is skipped when out_dir already
+    has its summary for the same text (manifest.json keeps the text hashes).
     """
-    chunks = chunk_text(text, CHUNK_CHAR_SIZE)
-    # safety: if text is short, run single summarization
-    if len(chunks) == 1:
-        out = summarizer(chunks[0], max_length=SUMMARY_MAX_LENGTH, min_length=SUMMARY_MIN_LENGTH, do_sample=False)
-        return out[0]['summary_text'].strip()
-
-    chunk_summaries = []
-    for i, c in enumerate(chunks, 1):
-        sys.stdout.write(f"Summarizing chunk {i}/{len(chunks)}...\n")
-        sys.stdout.flush()
-        # adjust max_length based on chunk length heuristically
-        out = summarizer(c, max_length=SUMMARY_MAX_LENGTH, min_length=SUMMARY_MIN_LENGTH, do_sample=False)
-        s = out[0]['summary_text'].strip()
-        chunk_summaries.append(s)
-
-    # join the short summaries and summarize them
-    combined = "\n\n".join(chunk_summaries)
-    sys.stdout.write("Summarizing combined chunk summaries into final summary...\n")
-    sys.stdout.flush()
-    # final summary shorter
-    final_out = summarizer(combined, max_length=SUMMARY_MAX_LENGTH, min_length=SUMMARY_MIN_LENGTH, do_sample=False)
-    return final_out[0]['summary_text'].strip()
+    chapters = read_chapters(book_path, pattern)
+    if not chapters:
+        print("No chapters found. Exiting.")
+        return None
+    os.makedirs(out_dir, exist_ok=True)
+    manifest = load_manifest(out_dir)
+    done = manifest.setdefault("chapters", {})
+
+    todo, summaries = [], {}
+    for i, (title, text) in enumerate(chapters, 1):
+        name = f"chapter_{i:03d}.txt"
+        entry = done.get(name)
+        if entry and entry["sha256"] == _sha256(text) and os.path.exists(os.path.join(out_dir, name)):
+            with open(os.path.join(out_dir, name), encoding="utf-8") as f:
+                summaries[i] = f.read().strip()
+        else:
+            todo.append((i, name, title, text))
+    print(f"{len(chapters)} chapters, {len(chapters) - len(todo)} already summarized, {len(todo)} to go.")
+
+    cores = multiprocessing.cpu_count()
+    workers = max(1, min(workers or max(1, cores // THREADS_PER_WORKER), max(1, len(todo))))
+    threads = threads or max(1, cores // workers)
+
+    def make_pool():
+        print(f"Using {workers} worker processes x {threads} threads ({model_name}, backend={backend})")
+        # spawn: each worker loads its own model; nothing torch-related is inherited
+        return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"),
+                                   initializer=_init_worker,
+                                   initargs=(model_name, device, backend, threads, use_cache))
+
+    t0 = time.perf_counter()
+    pool = make_pool() if todo else None   # no model is loaded when everything is already done
+    try:
+        futures = {
+            pool.submit(_summarize_in_worker, text, os.path.join(out_dir, name), chunk_tokens): (i, name, title, text)
+            for i, name, title, text in todo
+        }
+        for n, fut in enumerate(as_completed(futures), 1):
+            i, name, title, text = futures[fut]
+            summaries[i], seconds = fut.result()
+            done[name] = {"title": title, "sha256": _sha256(text), "chars": len(text)}
+            save_manifest(out_dir, manifest)
+            print(f"  [{n}/{len(todo)}] {title} ({len(text)} chars) in {seconds:.1f}s")
+
+        # whole book: the chapter summaries, in order, reduced like one long text
+        combined = "\n\n".join(summaries[i] for i in sorted(summaries))
+        book_out = os.path.join(out_dir, "book_summary.txt")
+        book_entry = manifest.get("book")
+        if book_entry and book_entry["sha256"] == _sha256(combined) and os.path.exists(book_out):
+            with open(book_out, encoding="utf-8") as f:
+                book_summary = f.read().strip()
+        else:
+            print("Summarizing chapter summaries into the whole-book summary...")
+            pool = pool or make_pool()
+            book_summary, _ = pool.submit(_summarize_in_worker, combined, book_out, chunk_tokens).result()
+            manifest["book"] = {"sha256": _sha256(combined), "chapters": len(chapters)}
+            save_manifest(out_dir, manifest)
+    finally:
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+
+    print(f"Done in {time.perf_counter() - t0:.1f}s. Summaries in {out_dir}/")
+    return book_summary
 
 def main():
     parser = argparse.ArgumentParser(description="Local chapter summarizer (English / Persian).")
@@ -98,22 +228,41 @@ def main():
     parser.add_argument("--lang", "-l", choices=["en", "fa"], default="en", help="Language of input (en or fa).")
     parser.add_argument("--model", help="(Optional) HuggingFace model name to use. If omitted, a default per-language will be used.")
     parser.add_argument("--device", type=int, default=-1, help="Device for model: -1 CPU, 0..n for GPU device IDs.")
+    parser.add_argument("--backend", choices=BACKENDS, default="torch", help="Inference backend (quantized / ONNX Runtime on CPU).")
+    parser.add_argument("--threads", type=int, help="CPU threads for inference (default: library default).")
+    parser.add_argument("--chunk-tokens", type=int, default=CHUNK_TOKENS, help="Max model tokens per chunk.")
+    parser.add_argument("--no-cache", action="store_true", help="Do not read or write the summary cache.")
+    parser.add_argument("--book", help="Batch mode: a book file (split into chapters) or a directory of chapter .txt files.")
+    parser.add_argument("--out-dir", default="summaries", help="Batch mode: where chapter and book summaries are written.")
+    parser.add_argument("--workers", type=int, help=f"Batch mode: worker processes (default: cores / {THREADS_PER_WORKER}).")
+    parser.add_argument("--chapter-pattern", default=CHAPTER_HEADING, help="Batch mode: regex for chapter heading lines.")
     args = parser.parse_args()
 
-    text = read_input(args.input_file)
-    if not text or text.strip() == "":
-        print("No input text provided. Exiting.")
-        return
-
     # select model
     if args.model:
         model_name = args.model
     else:
         model_name = DEFAULT_EN_MODEL if args.lang == "en" else DEFAULT_MULTI_MODEL
 
-    print(f"Using model: {model_name} (lang={args.lang})")
-    summarizer = create_summarizer(model_name, device=args.device)
-    final_summary = summarize_long_text(text, summarizer, lang=args.lang)
+    if args.book:
+        book_summary = summarize_book(
+            args.book, args.out_dir, model_name, device=args.device, backend=args.backend, workers=args.workers,
+            threads=args.threads, chunk_tokens=args.chunk_tokens, use_cache=not args.no_cache, pattern=args.chapter_pattern,
+        )
+        if book_summary:
+            print("\n" + "="*40 + "\nBOOK SUMMARY:\n" + "="*40 + "\n")
+            print(book_summary)
+        return
+
+    text = read_input(args.input_file)
+    if not text or text.strip() == "":
+        print("No input text provided. Exiting.")
+        return
+
+    print(f"Using model: {model_name} (lang={args.lang}, backend={args.backend})")
+    summarizer = create_summarizer(model_name, device=args.device, backend=args.backend, threads=args.threads)
+    cache = None if args.no_cache else SummaryCache()
+    final_summary = summarize_long_text(text, summarizer, lang=args.lang, chunk_tokens=args.chunk_tokens, cache=cache)
 
     print("\n" + "="*40 + "\nFINAL SUMMARY:\n" + "="*40 + "\n")
     print(final_summary)
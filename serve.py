@@ -0,0 +1,102 @@
+"""
+serve.py
+Production server: gunicorn with the models preloaded once in the master.
+
+The master imports app.py (loading the NER, summarization and recommender
+models) before forking, so all worker processes share those pages
+copy-on-write instead of each loading its own copy. Each worker then forks
+its own inference and stream processes (execution.py) for /summarize,
+/summarize/stream and /extract-names, which inherit the same pages. Every
+worker is a gthread worker: the NLP routes can occupy at most execution.request_slots() request
+threads (their limits + queues), and LIGHT_THREADS more are always left for
+/publishers, /subscribe and the static page.
+
+Usage:
+    python serve.py --workers 4 --bind 0.0.0.0:5000
+    python serve.py --workers 2 --nlp-processes 3 --light-threads 8
+"""
+
+import argparse
+import gc
+import multiprocessing
+import os
+
+from gunicorn.app.base import BaseApplication
+
+
+class PreloadedApp(BaseApplication):
+    def __init__(self, options):
+        self.options = options
+        super().__init__()
+
+    def load_config(self):
+        for key, value in self.options.items():
+            self.cfg.set(key, value)
+
+    def load(self):
+        from app import app   # runs once, in the master (preload_app=True)
+        # move everything loaded so far out of the garbage collector's reach:
+        # GC passes in the workers would otherwise write to (and un-share) those pages
+        gc.collect()
+        gc.freeze()
+        return app
+
+
+def _post_fork(server, worker):
+    # split the cores between workers instead of every worker using all of them
+    # (model work runs in the inference processes, but torch calls made in the
+    # worker itself must not claim every core either)
+    threads = int(os.environ.get("SUMMARIZER_THREADS", 0)) or max(1, multiprocessing.cpu_count() // server.cfg.workers)
+    try:
+        import torch
+        torch.set_num_threads(threads)
+    except ImportError:
+        pass
+    server.log.info("worker %s: %s torch threads", worker.pid, threads)
+
+
+def _post_worker_init(worker):
+    # fork the inference processes before the worker starts its request threads
+    import app
+    layer = app.execution
+    processes = worker.cfg.workers * (layer.processes + layer.stream_processes)
+    threads = int(os.environ.get("SUMMARIZER_THREADS", 0)) or max(1, multiprocessing.cpu_count() // processes)
+    layer.start(torch_threads=threads)
+    worker.log.info("worker %s: %s inference + %s stream processes x %s torch threads",
+                    worker.pid, layer.processes, layer.stream_processes, threads)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the API with gunicorn (preloaded models, NLP execution layer).")
+    parser.add_argument("--bind", default=f"0.0.0.0:{os.environ.get('PORT', 5000)}")
+    parser.add_argument("--workers", type=int, default=int(os.environ.get("WEB_CONCURRENCY", 2)))
+    parser.add_argument("--nlp-processes", type=int, help="Inference processes per worker (NLP_PROCESSES).")
+    parser.add_argument("--light-threads", type=int, help="Request threads reserved for light routes (LIGHT_THREADS).")
+    parser.add_argument("--timeout", type=int, default=300, help="Worker timeout in seconds.")
+    args = parser.parse_args()
+
+    # execution.py reads these when app.py is imported in load()
+    for name, value in (("NLP_PROCESSES", args.nlp_processes), ("LIGHT_THREADS", args.light_threads)):
+        if value is not None:
+            os.environ[name] = str(value)
+    from execution import LIGHT_THREADS, NLP_PROCESSES, request_slots
+
+    options = {
+        "bind": args.bind,
+        "workers": args.workers,
+        "worker_class": "gthread",
+        "threads": request_slots() + LIGHT_THREADS,
+        "preload_app": True,
+        "timeout": args.timeout,
+        "graceful_timeout": 30,
+        "keepalive": 5,
+        "post_fork": _post_fork,
+        "post_worker_init": _post_worker_init,
+    }
+    print(f"Starting {args.workers} workers x {options['threads']} threads "
+          f"(NLP {request_slots()}, light {LIGHT_THREADS}), {NLP_PROCESSES} inference processes each, on {args.bind}")
+    PreloadedApp(options).run()
+
+
+if __name__ == "__main__":
+    main()
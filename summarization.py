@@ -0,0 +1,336 @@
+"""
+summarization.py
+Shared summarization helpers used by the Flask app (/summarize) and the
+review.py CLI.
+
+Long texts are summarized map-reduce style:
+  1) split into chunks by *token* count (sentence boundaries where possible);
+     boundaries are content-defined, so editing one paragraph only changes
+     the chunks around it and the rest are served from the summary cache
+  2) summarize all chunks at once through a SummaryServer, which batches them
+  3) join the chunk summaries and repeat until everything fits in one chunk
+`iter_summarize_long` yields progress events as chunk summaries finish, so
+callers can stream progress for long chapters.
+
+`create_summarizer` can load the model with different CPU backends:
+  torch        stock PyTorch model
+  torch-int8   PyTorch with dynamic int8 quantization of Linear layers
+  onnx         ONNX Runtime graph (exported once, cached in ONNX_CACHE_DIR)
+  onnx-int8    ONNX Runtime graph with dynamic int8 quantization
+
+Usage (latency / memory / ROUGE of each backend against stock PyTorch):
+    python summarization.py bench --backends torch,torch-int8,onnx,onnx-int8 --threads 4
+"""
+
+import argparse
+import json
+import os
+import re
+import resource
+import shutil
+import subprocess
+import sys
+import time
+import zlib
+from collections import Counter
+from concurrent.futures import as_completed
+from pathlib import Path
+from typing import List
+
+from transformers import pipeline, AutoTokenizer, AutoModelForSeq2SeqLM
+
+from profiling import stage
+from summary_server import SummaryServer, DEFAULT_PARAMS
+
+# --------- Configurable defaults ----------
+CHUNK_TOKENS = 900   # max tokens per chunk; leaves room under BART's 1024 limit
+ANCHOR_DIVISOR = 4   # after half a chunk, ~1 in N sentences ends the chunk
+BACKENDS = ("torch", "torch-int8", "onnx", "onnx-int8")
+ONNX_CACHE_DIR = Path(os.environ.get("ONNX_CACHE_DIR", "onnx_models"))
+# ------------------------------------------
+
+_SENTENCE_END = re.compile(r'(?<=[.!؟!\n])\s+')  # includes Persian punctuation
+
+
+def _export_onnx(model_name: str) -> Path:
+    """Export the model to ONNX once and reuse the cached export afterwards."""
+    from optimum.onnxruntime import ORTModelForSeq2SeqLM
+
+    export_dir = ONNX_CACHE_DIR / model_name.replace("/", "__")
+    if not (export_dir / "config.json").exists():
+        print(f"Exporting {model_name} to ONNX (one-time) -> {export_dir}")
+        model = ORTModelForSeq2SeqLM.from_pretrained(model_name, export=True)
+        model.save_pretrained(export_dir)
+        AutoTokenizer.from_pretrained(model_name).save_pretrained(export_dir)
+    return export_dir
+
+
+def _quantize_onnx(export_dir: Path) -> Path:
+    from optimum.onnxruntime import ORTQuantizer
+    from optimum.onnxruntime.configuration import AutoQuantizationConfig
+
+    quant_dir = export_dir.with_name(export_dir.name + "-int8")
+    if not (quant_dir / "config.json").exists():
+        print(f"Quantizing ONNX graphs (one-time) -> {quant_dir}")
+        qconfig = AutoQuantizationConfig.avx2(is_static=False, per_channel=False)
+        for onnx_file in sorted(export_dir.glob("*.onnx")):
+            quantizer = ORTQuantizer.from_pretrained(export_dir, file_name=onnx_file.name)
+            # keep the original file names so the model loads without extra arguments
+            quantizer.quantize(save_dir=quant_dir, quantization_config=qconfig, file_suffix="")
+        for f in export_dir.iterdir():
+            if f.is_file() and f.suffix != ".onnx":
+                shutil.copy(f, quant_dir / f.name)
+    return quant_dir
+
+
+def create_summarizer(model_name: str, device: int = -1, backend: str = "torch", threads: int = None):
+    """
+    Create a transformers summarization pipeline.
+    device=-1 -> CPU, device=0 -> first GPU (torch backend only).
+    backend: one of BACKENDS. threads: intra-op CPU threads (None = library default).
+    """
+    if backend not in BACKENDS:
+        raise ValueError(f"unknown summarizer backend {backend!r}, expected one of {BACKENDS}")
+
+    if backend.startswith("onnx"):
+        import onnxruntime as ort
+        from optimum.onnxruntime import ORTModelForSeq2SeqLM
+
+        model_dir = _export_onnx(model_name)
+        if backend == "onnx-int8":
+            model_dir = _quantize_onnx(model_dir)
+        options = ort.SessionOptions()
+        if threads:
+            options.intra_op_num_threads = threads
+        tokenizer = AutoTokenizer.from_pretrained(model_dir)
+        model = ORTModelForSeq2SeqLM.from_pretrained(model_dir, session_options=options)
+        summarizer = pipeline("summarization", model=model, tokenizer=tokenizer)
+    else:
+        import torch
+
+        if threads:
+            torch.set_num_threads(threads)
+        tokenizer = AutoTokenizer.from_pretrained(model_name)
+        model = AutoModelForSeq2SeqLM.from_pretrained(model_name)
+        if backend == "torch-int8":
+            model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+        summarizer = pipeline("summarization", model=model, tokenizer=tokenizer, device=device)
+
+    # outputs differ slightly between backends, so they get separate cache entries
+    summarizer.cache_name = model_name if backend == "torch" else f"{model_name}@{backend}"
+    return summarizer
+
+
+def max_chunk_tokens(tokenizer, limit: int = CHUNK_TOKENS) -> int:
+    # some tokenizers report a huge sentinel model_max_length; ignore those
+    model_max = getattr(tokenizer, "model_max_length", None) or limit
+    if model_max < 100000:
+        limit = min(limit, model_max - 4)
+    return max(16, limit)
+
+
+def _is_anchor(sentence: str) -> bool:
+    # depends only on the sentence itself, so chunk boundaries re-align after an edit
+    return zlib.crc32(sentence.encode("utf-8")) % ANCHOR_DIVISOR == 0
+
+
+def chunk_text(text: str, tokenizer, max_tokens: int = CHUNK_TOKENS) -> List[str]:
+    """
+    Split text into chunks of at most max_tokens tokens, on sentence boundaries where possible.
+    Once a chunk holds max_tokens/2 tokens it ends at the next "anchor" sentence
+    (chosen by a hash of the sentence text), which keeps boundaries stable when
+    unrelated parts of the text change.
+    """
+    sentences = [s.strip() for s in _SENTENCE_END.split(text) if s.strip()]
+    if not sentences:
+        return []
+    lengths = [len(ids) for ids in tokenizer(sentences, add_special_tokens=False)["input_ids"]]
+    min_tokens = max_tokens // 2
+
+    chunks, current, current_len = [], [], 0
+    for sentence, n in zip(sentences, lengths):
+        if n > max_tokens:
+            # a single sentence over the limit: cut it into token windows
+            if current:
+                chunks.append(" ".join(current))
+                current, current_len = [], 0
+            ids = tokenizer(sentence, add_special_tokens=False)["input_ids"]
+            for s in range(0, len(ids), max_tokens):
+                chunks.append(tokenizer.decode(ids[s:s + max_tokens], skip_special_tokens=True))
+            continue
+        if current and current_len + n > max_tokens:
+            chunks.append(" ".join(current))
+            current, current_len = [], 0
+        current.append(sentence)
+        current_len += n
+        if current_len >= min_tokens and _is_anchor(sentence):
+            chunks.append(" ".join(current))
+            current, current_len = [], 0
+    if current:
+        chunks.append(" ".join(current))
+    return chunks
+
+
+def iter_summarize_long(text: str, server: SummaryServer, tokenizer, max_tokens: int = CHUNK_TOKENS,
+                        stream_final: bool = False, **params):
+    """
+    Hierarchical summarization as a stream of events:
+      {"event": "level", "level": L, "chunks": N}
+      {"event": "chunk", "level": L, "index": i, "total": N, "summary": ...}   (in completion order)
+      {"event": "token", "text": ...}   (only with stream_final: pieces of the final summary)
+      {"event": "final", "summary": ...}
+    All chunks of a level are submitted at once (submit_many), so the server
+    batches them even when it does not wait for more items (max_wait_ms=0).
+    """
+    params = dict(DEFAULT_PARAMS, **params)
+    max_tokens = max_chunk_tokens(tokenizer, max_tokens)
+    with stage("summarize.chunk"):
+        chunks = chunk_text(text, tokenizer, max_tokens) or [text]
+    level = 0
+    while True:
+        yield {"event": "level", "level": level, "chunks": len(chunks)}
+        if len(chunks) == 1:
+            if stream_final:
+                pieces = []
+                for piece in server.stream(chunks[0], **params):
+                    pieces.append(piece)
+                    yield {"event": "token", "text": piece}
+                yield {"event": "final", "summary": "".join(pieces).strip()}
+            else:
+                yield {"event": "final", "summary": server.summarize(chunks[0], **params)}
+            return
+
+        futures = {fut: i for i, fut in enumerate(server.submit_many(chunks, **params))}
+        summaries = [None] * len(chunks)
+        for fut in as_completed(futures):
+            i = futures[fut]
+            summaries[i] = fut.result()
+            yield {"event": "chunk", "level": level, "index": i, "total": len(chunks), "summary": summaries[i]}
+
+        combined = "\n\n".join(summaries)
+        with stage("summarize.chunk"):
+            next_chunks = chunk_text(combined, tokenizer, max_tokens)
+        if len(next_chunks) >= len(chunks):
+            # summaries are not getting shorter; let the model truncate the rest
+            next_chunks = [combined]
+        chunks = next_chunks
+        level += 1
+
+
+def summarize_long(text: str, server: SummaryServer, tokenizer, max_tokens: int = CHUNK_TOKENS, progress=None, **params) -> str:
+    """Run iter_summarize_long to completion; progress(event) is called for every event."""
+    for event in iter_summarize_long(text, server, tokenizer, max_tokens, **params):
+        if progress:
+            progress(event)
+        if event["event"] == "final":
+            return event["summary"]
+    return ""
+
+
+# ---------------------------
+# Backend benchmark
+# ---------------------------
+def _rouge_tokens(text):
+    return re.findall(r"\w+", text.lower())
+
+
+def _lcs_len(a, b):
+    prev = [0] * (len(b) + 1)
+    for x in a:
+        cur = [0]
+        for j, y in enumerate(b, 1):
+            cur.append(prev[j - 1] + 1 if x == y else max(prev[j], cur[j - 1]))
+        prev = cur
+    return prev[-1]
+
+
+def _f1(overlap, n_ref, n_hyp):
+    if not overlap or not n_ref or not n_hyp:
+        return 0.0
+    p, r = overlap / n_hyp, overlap / n_ref
+    return 2 * p * r / (p + r)
+
+
+def rouge(reference, hypothesis):
+    """ROUGE-1 and ROUGE-L F1 (plain token overlap, no stemming)."""
+    ref, hyp = _rouge_tokens(reference), _rouge_tokens(hypothesis)
+    r1 = _f1(sum((Counter(ref) & Counter(hyp)).values()), len(ref), len(hyp))
+    rl = _f1(_lcs_len(ref, hyp), len(ref), len(hyp))
+    return r1, rl
+
+
+def _bench_one(model_name, backend, threads, texts):
+    """Load one backend and summarize texts (run in a fresh process)."""
+    t0 = time.perf_counter()
+    summarizer = create_summarizer(model_name, backend=backend, threads=threads)
+    load_s = time.perf_counter() - t0
+    summarizer(texts[0], truncation=True, **DEFAULT_PARAMS)  # warm-up
+
+    latencies, summaries = [], []
+    for text in texts:
+        t0 = time.perf_counter()
+        out = summarizer(text, truncation=True, **DEFAULT_PARAMS)
+        latencies.append(time.perf_counter() - t0)
+        summaries.append(out[0]["summary_text"].strip())
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    return {"load_s": load_s, "latencies": latencies, "summaries": summaries, "peak_rss": peak_rss}
+
+
+def benchmark(model_name, backends, threads, input_file=None, n=8):
+    results = {}
+    for backend in backends:
+        cmd = [sys.executable, os.path.abspath(__file__), "_bench_one", "--model", model_name,
+               "--backend", backend, "--n", str(n)]
+        if threads:
+            cmd += ["--threads", str(threads)]
+        if input_file:
+            cmd += ["--input-file", input_file]
+        out = subprocess.run(cmd, check=True, capture_output=True, text=True).stdout
+        results[backend] = json.loads(out.strip().splitlines()[-1])
+
+    reference = results.get("torch")
+    print(f"{'backend':>11} {'load s':>7} {'peak MB':>8} {'mean ms':>8} {'p95 ms':>8} {'ROUGE-1':>8} {'ROUGE-L':>8}")
+    for backend, r in results.items():
+        lat = sorted(r["latencies"])
+        mean_ms = 1000.0 * sum(lat) / len(lat)
+        p95_ms = 1000.0 * lat[min(len(lat) - 1, int(0.95 * len(lat)))]
+        if reference:
+            scores = [rouge(ref, hyp) for ref, hyp in zip(reference["summaries"], r["summaries"])]
+            r1 = sum(s[0] for s in scores) / len(scores)
+            rl = sum(s[1] for s in scores) / len(scores)
+            rouge_cols = f"{r1:>8.3f} {rl:>8.3f}"
+        else:
+            rouge_cols = f"{'-':>8} {'-':>8}"
+        print(f"{backend:>11} {r['load_s']:>7.1f} {r['peak_rss'] / 2 ** 20:>8.0f} {mean_ms:>8.0f} {p95_ms:>8.0f} {rouge_cols}")
+    if reference:
+        print("(ROUGE is measured against the stock torch backend's summaries)")
+
+
+def main():
+    from summary_server import _bench_texts
+
+    parser = argparse.ArgumentParser(description="Summarizer backend benchmark.")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    b = sub.add_parser("bench")
+    b.add_argument("--model", default="facebook/bart-large-cnn")
+    b.add_argument("--backends", default="torch,torch-int8,onnx", help="Comma-separated list; include torch for ROUGE.")
+    b.add_argument("--threads", type=int)
+    b.add_argument("--n", type=int, default=8, help="Number of texts to summarize per backend.")
+    b.add_argument("--input-file", help="Text file; paragraphs (blank-line separated) are used as inputs.")
+    one = sub.add_parser("_bench_one")
+    one.add_argument("--model", required=True)
+    one.add_argument("--backend", choices=BACKENDS, required=True)
+    one.add_argument("--threads", type=int)
+    one.add_argument("--n", type=int, default=8)
+    one.add_argument("--input-file")
+    args = parser.parse_args()
+
+    if args.cmd == "bench":
+        benchmark(args.model, args.backends.split(","), args.threads, args.input_file, args.n)
+    else:
+        texts = _bench_texts(args.n, args.input_file)
+        print(json.dumps(_bench_one(args.model, args.backend, args.threads, texts)))
+
+
+if __name__ == "__main__":
+    main()
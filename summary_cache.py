@@ -0,0 +1,112 @@
+# summary_cache.py
+# Persistent summary cache shared by /summarize and review.py.
+#
+# Entries are keyed by (model name, generation params, sha256 of the
+# whitespace/Unicode-normalized text) and stored in a SQLite file, so they
+# survive restarts and can be shared by several processes. The cache is
+# bounded by total summary size; the least recently used entries are evicted
+# first. SummaryServer consults it for every text it is given, which includes
+# the individual chunks of long documents.
+
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+
+# --------- Configurable defaults ----------
+CACHE_PATH = os.environ.get("SUMMARY_CACHE_PATH", "summary_cache.sqlite3")
+MAX_BYTES = int(float(os.environ.get("SUMMARY_CACHE_MAX_MB", 256)) * 1024 * 1024)
+EVICT_EVERY = 64   # check the size bound every N inserts
+# ------------------------------------------
+
+_WS = re.compile(r"\s+")
+
+
+def normalize_text(text):
+    return _WS.sub(" ", unicodedata.normalize("NFC", text)).strip()
+
+
+class SummaryCache:
+    def __init__(self, path=CACHE_PATH, max_bytes=MAX_BYTES):
+        self.path = str(path)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._local = threading.local()
+        self._puts = 0
+        with self._conn() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS summaries ("
+                " key TEXT PRIMARY KEY, summary TEXT NOT NULL,"
+                " size INTEGER NOT NULL, last_used REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS summaries_last_used ON summaries(last_used)")
+
+    def _conn(self):
+        # one connection per thread (and per process after a fork)
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    @staticmethod
+    def key(model_name, params, text):
+        text_hash = hashlib.sha256(normalize_text(text).encode("utf-8")).hexdigest()
+        raw = json.dumps([model_name, params, text_hash], sort_keys=True, default=str)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        try:
+            with self._conn() as conn:
+                row = conn.execute("SELECT summary FROM summaries WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    conn.execute("UPDATE summaries SET last_used = ? WHERE key = ?", (time.time(), key))
+        except sqlite3.Error as e:
+            print("[SummaryCache] read error:", e)
+            row = None
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return row[0]
+
+    def put(self, key, summary):
+        try:
+            with self._conn() as conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO summaries (key, summary, size, last_used) VALUES (?, ?, ?, ?)",
+                    (key, summary, len(summary.encode("utf-8")), time.time()),
+                )
+            self._puts += 1
+            if self._puts % EVICT_EVERY == 0:
+                self.evict()
+        except sqlite3.Error as e:
+            print("[SummaryCache] write error:", e)
+
+    def evict(self):
+        """Drop least recently used entries until the total size is under max_bytes."""
+        with self._conn() as conn:
+            total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM summaries").fetchone()[0]
+            if total <= self.max_bytes:
+                return 0
+            removed = 0
+            for key, size in conn.execute("SELECT key, size FROM summaries ORDER BY last_used").fetchall():
+                if total <= self.max_bytes:
+                    break
+                conn.execute("DELETE FROM summaries WHERE key = ?", (key,))
+                total -= size
+                removed += 1
+        return removed
+
+    def stats(self):
+        with self._conn() as conn:
+            entries, size = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM summaries").fetchone()
+        return {"entries": entries, "bytes": size, "hits": self.hits, "misses": self.misses}
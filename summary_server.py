@@ -0,0 +1,248 @@
+"""
+summary_server.py
+In-process summarization server for the Flask app.
+
+Each /summarize request submits its text to a queue; a worker thread
+groups waiting requests into micro-batches and runs them through the
+summarization pipeline as one padded batch, instead of every request thread
+calling the model on its own. An optional SummaryCache is checked before
+queueing, so repeated texts (and repeated chunks of long texts) skip the model.
+`stream()` bypasses the batcher and yields text as the model decodes it.
+
+Usage (throughput under concurrent load vs one-at-a-time calls):
+    python summary_server.py bench --clients 8 --requests 32
+    python summary_server.py bench --clients 8 --requests 32 --processes 2   # + through execution.py
+"""
+
+import argparse
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from batching import MicroBatcher
+from profiling import stage
+
+# --------- Configurable defaults ----------
+DEFAULT_PARAMS = {"max_length": 130, "min_length": 30, "do_sample": False}
+# transformers streamers do not support beam search, so streaming decodes greedily
+STREAM_PARAMS = {"num_beams": 1}
+MAX_BATCH_SIZE = int(os.environ.get("SUMMARY_MAX_BATCH", 8))
+MAX_WAIT_MS = float(os.environ.get("SUMMARY_MAX_WAIT_MS", 20))
+# ------------------------------------------
+
+
+class SummaryServer:
+    def __init__(self, summarizer, max_batch_size=MAX_BATCH_SIZE, max_wait_ms=MAX_WAIT_MS, cache=None,
+                 runner=None, concurrency=1):
+        """
+        runner: fn(items) -> summaries that runs one batch somewhere else
+        (app.py sends it to an inference process, see execution.py); by default
+        run_batch is called in this process. concurrency: batches in flight.
+        """
+        self.summarizer = summarizer
+        self.model_name = (
+            getattr(summarizer, "cache_name", None)
+            or getattr(summarizer.model, "name_or_path", "")
+            or type(summarizer.model).__name__
+        )
+        self.cache = cache
+        self.batcher = MicroBatcher(runner or self.run_batch, max_batch_size, max_wait_ms,
+                                    name="summarizer", concurrency=concurrency)
+
+    def run_batch(self, items):
+        """Summarize a batch of (text, params) items with the model (no queue, no cache)."""
+        texts = [text for text, _ in items]
+        params = items[0][1]  # all items in a batch share the same params (batch key)
+        outs = self.summarizer(texts, batch_size=len(texts), truncation=True, **params)
+        return [o["summary_text"].strip() for o in outs]
+
+    def submit(self, text, **params):
+        """Queue one text; returns a Future resolving to the summary string."""
+        return self.submit_many([text], **params)[0]
+
+    def submit_many(self, texts, **params):
+        """
+        Queue several texts at once (e.g. the chunks of one level), so they
+        land in the same batch; returns one Future per text, in order.
+        """
+        params = dict(DEFAULT_PARAMS, **params)
+        futures = [None] * len(texts)
+        misses, keys = [], []
+        for i, text in enumerate(texts):
+            cache_key = None
+            if self.cache is not None:
+                with stage("summary_cache.get"):
+                    cache_key = self.cache.key(self.model_name, params, text)
+                    cached = self.cache.get(cache_key)
+                if cached is not None:
+                    futures[i] = Future()
+                    futures[i].set_result(cached)
+                    continue
+            misses.append(i)
+            keys.append(cache_key)
+
+        queued = self.batcher.submit_many([(texts[i], params) for i in misses], key=tuple(sorted(params.items())))
+        for i, cache_key, fut in zip(misses, keys, queued):
+            if cache_key is not None:
+                fut.add_done_callback(lambda f, k=cache_key: self._store(k, f))
+            futures[i] = fut
+        return futures
+
+    def stream(self, text, **params):
+        """
+        Yield pieces of the summary as they are generated (greedy decoding).
+        A cached summary is yielded in one piece.
+        """
+        from transformers import TextIteratorStreamer
+
+        params = dict(DEFAULT_PARAMS, **params)
+        params.update(STREAM_PARAMS)
+        cache_key = None
+        if self.cache is not None:
+            cache_key = self.cache.key(self.model_name, params, text)
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                yield cached
+                return
+
+        tokenizer = self.summarizer.tokenizer
+        model = self.summarizer.model
+        inputs = tokenizer(text, return_tensors="pt", truncation=True)
+        streamer = TextIteratorStreamer(tokenizer, skip_prompt=True, skip_special_tokens=True)
+        errors = []
+
+        def generate():
+            try:
+                model.generate(**inputs, streamer=streamer, **params)
+            except Exception as e:
+                errors.append(e)
+                streamer.end()
+
+        worker = threading.Thread(target=generate, name="summarizer-stream", daemon=True)
+        worker.start()
+        pieces = []
+        for piece in streamer:
+            if piece:
+                pieces.append(piece)
+                yield piece
+        worker.join()
+        if errors:
+            raise errors[0]
+        if cache_key is not None:
+            self.cache.put(cache_key, "".join(pieces).strip())
+
+    def _store(self, cache_key, fut):
+        if not fut.cancelled() and fut.exception() is None:
+            self.cache.put(cache_key, fut.result())
+
+    def summarize(self, text, timeout=None, **params):
+        return self.submit(text, **params).result(timeout)
+
+
+# ---------------------------
+# Benchmark
+# ---------------------------
+SAMPLE_TEXT = (
+    "The old kingdom had been at peace for a hundred years when the first dragon returned. "
+    "It came at dusk over the northern mountains, and by morning three villages were ash. "
+    "The queen summoned her council, but the wizards argued among themselves while the knights "
+    "demanded to ride out at once. Only the young archivist remembered the prophecy hidden in the "
+    "vaults beneath the palace, a prophecy that spoke of a sword forged from starlight and a bearer "
+    "who would be neither noble nor soldier. She slipped away from the city that night with a stolen "
+    "map and a lantern, determined to find the forge before the dragon found the capital. "
+)
+
+
+def _bench_texts(n, input_file=None):
+    if input_file:
+        with open(input_file, encoding="utf-8") as f:
+            paragraphs = [p.strip() for p in f.read().split("\n\n") if p.strip()]
+    else:
+        paragraphs = [SAMPLE_TEXT * (1 + i % 3) for i in range(4)]
+    return [paragraphs[i % len(paragraphs)] for i in range(n)]
+
+
+def _run_load(call, texts, clients):
+    latencies = []
+
+    def one(text):
+        t0 = time.perf_counter()
+        call(text)
+        latencies.append(time.perf_counter() - t0)
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=clients) as pool:
+        list(pool.map(one, texts))
+    wall = time.perf_counter() - t0
+    latencies.sort()
+
+    def pct(q):
+        return latencies[min(len(latencies) - 1, int(q * len(latencies)))] * 1000.0
+
+    return len(texts) / wall, pct(0.50), pct(0.95)
+
+
+_bench_server = None
+
+
+def _bench_batch(items):
+    # runs in an inference process forked by benchmark(), which inherited _bench_server
+    return _bench_server.run_batch(items)
+
+
+def benchmark(summarizer, clients=8, requests=32, input_file=None, max_batch_size=MAX_BATCH_SIZE, max_wait_ms=MAX_WAIT_MS,
+              processes=0):
+    global _bench_server
+    texts = _bench_texts(requests, input_file)
+    summarizer(texts[0], **DEFAULT_PARAMS)  # warm-up
+
+    layer = None
+    if processes:
+        # the app's path: batches formed here, run in forked inference processes (execution.py);
+        # fork before any benchmark thread exists
+        from execution import ENDPOINTS, ExecutionLayer
+        layer = ExecutionLayer({"summarize": ENDPOINTS["summarize"]}, processes=processes)
+        _bench_server = SummaryServer(summarizer, max_batch_size, max_wait_ms, concurrency=processes,
+                                      runner=lambda items: layer.run_batch("summarize", _bench_batch, items))
+        layer.start()
+
+    print(f"{'path':>12} {'req/s':>8} {'p50 ms':>9} {'p95 ms':>9}")
+    rps, p50, p95 = _run_load(lambda t: summarizer(t, truncation=True, **DEFAULT_PARAMS), texts, clients)
+    print(f"{'per-request':>12} {rps:>8.2f} {p50:>9.0f} {p95:>9.0f}")
+
+    server = SummaryServer(summarizer, max_batch_size, max_wait_ms)
+    rps, p50, p95 = _run_load(server.summarize, texts, clients)
+    print(f"{'batched':>12} {rps:>8.2f} {p50:>9.0f} {p95:>9.0f}   (mean batch size {server.batcher.mean_batch_size:.1f})")
+
+    if layer is not None:
+        rps, p50, p95 = _run_load(_bench_server.summarize, texts, clients)
+        print(f"{'processes':>12} {rps:>8.2f} {p50:>9.0f} {p95:>9.0f}   "
+              f"(mean batch size {_bench_server.batcher.mean_batch_size:.1f}, {processes} processes)")
+
+
+def main():
+    from transformers import pipeline, AutoTokenizer, AutoModelForSeq2SeqLM
+
+    parser = argparse.ArgumentParser(description="Summarization micro-batching benchmark.")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    b = sub.add_parser("bench")
+    b.add_argument("--model", default="facebook/bart-large-cnn")
+    b.add_argument("--clients", type=int, default=8, help="Concurrent client threads.")
+    b.add_argument("--requests", type=int, default=32)
+    b.add_argument("--max-batch-size", type=int, default=MAX_BATCH_SIZE)
+    b.add_argument("--max-wait-ms", type=float, default=MAX_WAIT_MS)
+    b.add_argument("--input-file", help="Text file; paragraphs (blank-line separated) are used as requests.")
+    b.add_argument("--processes", type=int, default=0,
+                   help="Also run the batches in this many inference processes, as the app does.")
+    args = parser.parse_args()
+
+    tokenizer = AutoTokenizer.from_pretrained(args.model)
+    model = AutoModelForSeq2SeqLM.from_pretrained(args.model)
+    summarizer = pipeline("summarization", model=model, tokenizer=tokenizer, device=-1)
+    benchmark(summarizer, args.clients, args.requests, args.input_file, args.max_batch_size, args.max_wait_ms,
+              args.processes)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+import tempfile
+import time
+import unittest
+from pathlib import Path
+
+import publisher_health
+from publisher_health import PublisherHealth
+
+CONFIGURED_MS = 90000
+
+
+class PublisherHealthTimeoutTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.health = PublisherHealth(Path(self.dir.name) / "publisher_health.json")
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def scrape(self, name, load_ms):
+        """One run against a site that takes load_ms to load; True if it loaded in budget."""
+        if not self.health.allow(name):
+            return False
+        if load_ms <= self.health.timeout_ms(name, CONFIGURED_MS):
+            self.health.record_success(name, load_ms / 1000.0, [{"title": "Book"}])
+            return True
+        self.health.record_failure(name, "Timeout")
+        return False
+
+    def test_site_that_got_slower_recovers(self):
+        for _ in range(5):
+            self.assertTrue(self.scrape("Slow", 1000))
+        self.assertEqual(self.health.timeout_ms("Slow", CONFIGURED_MS), publisher_health.MIN_TIMEOUT_MS)
+
+        # 1 s -> 12 s: the first run times out, the doubled budget (20 s) lets the next one through
+        results = [self.scrape("Slow", 12000) for _ in range(publisher_health.FAILURE_THRESHOLD)]
+        self.assertEqual(results[:2], [False, True])
+        self.assertEqual(self.health.state["Slow"]["failures"], 0)
+        self.assertFalse(self.health.state["Slow"]["open_until"])
+        self.assertGreaterEqual(self.health.timeout_ms("Slow", CONFIGURED_MS), 12000)
+
+    def test_doubling_applies_after_the_floor(self):
+        for _ in range(5):
+            self.scrape("Fast", 1000)
+        self.health.record_failure("Fast", "Timeout")
+        self.health.record_failure("Fast", "Timeout")
+        self.assertEqual(self.health.timeout_ms("Fast", CONFIGURED_MS), publisher_health.MIN_TIMEOUT_MS * 4)
+        self.assertEqual(self.health.timeout_ms("Fast", 30000), 30000)
+
+    def test_trial_gets_the_full_trial_budget(self):
+        for _ in range(5):
+            self.scrape("Down", 1000)
+        for _ in range(publisher_health.FAILURE_THRESHOLD):
+            self.health.record_failure("Down", "Timeout")
+        self.assertFalse(self.health.allow("Down"))
+
+        self.health.state["Down"]["open_until"] = time.time() - 1   # cool-down over
+        self.health._save()
+        self.assertTrue(self.health.allow("Down"))
+        self.assertFalse(self.health.allow("Down"))   # one trial at a time
+        self.assertEqual(self.health.timeout_ms("Down", CONFIGURED_MS), publisher_health.TRIAL_TIMEOUT_MS)
+        self.assertEqual(self.health.timeout_ms("Down", 15000), 15000)
+
+        self.health.record_success("Down", 12.0, [])
+        self.assertTrue(self.health.allow("Down"))
+        self.assertEqual(self.health.state["Down"]["cooldown_s"], publisher_health.COOLDOWN_S)
+
+
+if __name__ == "__main__":
+    unittest.main()